@@ -0,0 +1,89 @@
+"""
+Script comparing repeated strings stored as text against categorical encoding.
+
+It builds synthetic cultural event rows, whose city / event type / genre columns
+repeat a handful of values, and reports the DataFrame memory with object versus
+category dtypes, then the time to insert them and the resulting SQLite file size
+with the strings stored as text versus as ids into `category_values`.
+"""
+
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+tmp_dir = tempfile.mkdtemp()
+os.environ['SQLITE_DB_FILE'] = os.path.join(tmp_dir, 'benchmark.db')
+
+from sqlalchemy import Column, MetaData, String, Table, create_engine
+
+from citypulse_etl import models, pipeline
+from citypulse_etl.database import Session, get_engine
+
+N_ROWS = 500_000
+CITIES = ['Aarhus C', 'Aarhus N', 'Aarhus V', 'Viby J', 'Højbjerg', 'Brabrand']
+EVENT_TYPES = ['Musik', 'Teater', 'Foredrag', 'Udstilling', 'Børn']
+GENRES = ['Klassisk', 'Rock', 'Jazz', 'Pop', 'Folk', 'Elektronisk', None]
+
+def make_rows():
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'city': rng.choice(CITIES, N_ROWS),
+        'event_type': rng.choice(EVENT_TYPES, N_ROWS),
+        'genre': rng.choice(np.array(GENRES, dtype=object), N_ROWS),
+        'timestamp': pd.date_range('2014-08-01', periods=N_ROWS, freq='min'),
+    })
+
+def insert_text(df):
+    # Baseline: the same table with the categorical columns stored as text
+    db_file = os.path.join(tmp_dir, 'text.db')
+    engine = create_engine(f'sqlite:///{db_file}')
+    encoded = models.encoded_columns(models.CulturalEventData)
+    metadata = MetaData()
+    table = Table('cultural_event_data', metadata, *[
+        Column(encoded[c.name], String) if c.name in encoded
+        else Column(c.name, c.type, primary_key=c.primary_key)
+        for c in models.CulturalEventData.__table__.c
+        ])
+    metadata.create_all(engine)
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(table.insert(), df.to_dict(orient='records'))
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+    return elapsed, os.path.getsize(db_file)
+
+def insert_encoded(df):
+    models.create_tables()
+    session = Session()
+    dataset = models.Dataset(name='Benchmark Cultural Events', url='http://localhost/events')
+    session.add(dataset)
+    session.flush()
+    df = df.assign(dataset_id=dataset.id)
+    start = time.perf_counter()
+    for c in models.CulturalEventData.categorical_columns:
+        df[c] = df[c].astype('category')
+    pipeline.insert_rows_from_df(df, models.CulturalEventData, session)
+    session.commit()
+    elapsed = time.perf_counter() - start
+    session.close()
+    get_engine().dispose()
+    return elapsed, os.path.getsize(os.environ['SQLITE_DB_FILE'])
+
+def main():
+    df = make_rows()
+    columns = models.CulturalEventData.categorical_columns
+    object_bytes = df[columns].memory_usage(deep=True).sum()
+    category_bytes = df[columns].astype('category').memory_usage(deep=True).sum()
+    print(f"{N_ROWS} rows, columns {', '.join(columns)}")
+    print(f"{'':<12} {'memory':>10} {'insert':>9} {'db size':>10}")
+    text_time, text_size = insert_text(df.astype(object).where(df.notna(), None))
+    encoded_time, encoded_size = insert_encoded(df)
+    print(f"{'text':<12} {object_bytes / 1e6:8.1f}MB {text_time:8.2f}s {text_size / 1e6:8.1f}MB")
+    print(f"{'categorical':<12} {category_bytes / 1e6:8.1f}MB {encoded_time:8.2f}s {encoded_size / 1e6:8.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
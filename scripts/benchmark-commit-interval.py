@@ -0,0 +1,94 @@
+"""
+Script benchmarking the throughput of the pipeline's commit intervals.
+
+It loads a synthetic road traffic dataset into a throwaway SQLite database with
+each `--commit-interval` setting and journal mode, reporting the rows loaded per
+second and the largest the rollback journal / WAL file grew to during the load.
+"""
+
+import os
+import tarfile
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+tmp_dir = tempfile.mkdtemp()
+os.environ['RAW_DATA_DIR'] = os.path.join(tmp_dir, 'raw')
+os.environ['SQLITE_DB_FILE'] = os.path.join(tmp_dir, 'benchmark.db')
+
+from citypulse_etl import database, models, pipeline
+from citypulse_etl.utils import raw_data_dir
+
+N_FILES = 40
+N_ROWS_PER_FILE = 10_000
+DATASET = {
+    'name': 'Benchmark Road Traffic Dataset',
+    'data_type': 'Road Traffic Data',
+    'url': 'http://localhost/benchmark_traffic.tar.gz',
+    'location': 'Aarhus',
+}
+
+def write_dataset():
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range('2014-02-13', periods=N_ROWS_PER_FILE, freq='5min')
+    with tarfile.open(os.path.join(raw_data_dir(), 'benchmark_traffic.tar.gz'), 'w:gz') as tar:
+        for report_id in range(N_FILES):
+            fname = os.path.join(tmp_dir, f'trafficData{report_id}.csv')
+            pd.DataFrame({
+                'status': 'OK',
+                'avgMeasuredTime': rng.integers(10, 100, N_ROWS_PER_FILE),
+                'avgSpeed': rng.integers(0, 90, N_ROWS_PER_FILE),
+                'extID': report_id,
+                'medianMeasuredTime': rng.integers(10, 100, N_ROWS_PER_FILE),
+                'TIMESTAMP': timestamps.strftime('%Y-%m-%dT%H:%M:%S'),
+                'vehicleCount': rng.integers(0, 20, N_ROWS_PER_FILE),
+                '_id': np.arange(N_ROWS_PER_FILE),
+                'REPORT_ID': report_id,
+            }).to_csv(fname, index=False)
+            tar.add(fname, arcname=os.path.basename(fname))
+
+def watch_journal_size(stop: threading.Event, peak: list):
+    db_file = os.environ['SQLITE_DB_FILE']
+    while not stop.is_set():
+        for suffix in ('-journal', '-wal'):
+            try:
+                peak[0] = max(peak[0], os.path.getsize(db_file + suffix))
+            except OSError:
+                pass
+        time.sleep(0.005)
+
+def run(commit_interval, journal_mode):
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        if os.path.exists(os.environ['SQLITE_DB_FILE'] + suffix):
+            os.remove(os.environ['SQLITE_DB_FILE'] + suffix)
+    os.environ['SQLITE_JOURNAL_MODE'] = journal_mode
+    database.get_engine.cache_clear()
+    models.create_tables()
+
+    stop, peak = threading.Event(), [0]
+    watcher = threading.Thread(target=watch_journal_size, args=(stop, peak))
+    watcher.start()
+    start = time.perf_counter()
+    pipeline.run_pipeline(dict(DATASET), skip_download=True, commit_interval=commit_interval)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    watcher.join()
+
+    n_rows = N_FILES * N_ROWS_PER_FILE
+    print(f"{str(commit_interval):<10} {journal_mode:<8} {elapsed:8.2f}s {n_rows / elapsed:10.0f} rows/s "
+          f"{peak[0] / 1e6:10.1f}MB")
+
+def main():
+    write_dataset()
+    print(f"{N_FILES} files x {N_ROWS_PER_FILE} rows")
+    print(f"{'interval':<10} {'journal':<8} {'time':>9} {'throughput':>17} {'peak journal':>12}")
+    for journal_mode in ('DELETE', 'WAL'):
+        for commit_interval in ('file', 50_000, 'dataset'):
+            run(commit_interval, journal_mode)
+
+
+if __name__ == '__main__':
+    main()
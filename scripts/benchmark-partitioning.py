@@ -0,0 +1,85 @@
+"""
+Script comparing a single road traffic table with one partitioned by month.
+
+It loads a year of synthetic road traffic readings a month at a time into a
+throwaway SQLite database with each layout, reporting the time to insert the
+first and last months (as the table and its indexes grow) and the time to query
+one sensor's readings for a day and for a month.
+"""
+
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+tmp_dir = tempfile.mkdtemp()
+
+from citypulse_etl import database, models, pipeline, query
+
+N_MONTHS = 12
+N_SENSORS = 10
+READING_FREQ = '5min'
+N_REPEATS = 20
+
+def make_month(month, rng):
+    timestamps = pd.date_range(month, month + pd.offsets.MonthBegin(1), freq=READING_FREQ, inclusive='left')
+    n = len(timestamps) * N_SENSORS
+    return pd.DataFrame({
+        'status': pd.Categorical(np.where(rng.random(n) < 0.99, 'OK', 'ERROR')),
+        'avg_measured_time': rng.integers(30, 120, n).astype(float),
+        'avg_speed': rng.integers(20, 90, n).astype(float),
+        'ext_id': rng.integers(1000, 2000, n),
+        'median_measured_time': rng.integers(30, 120, n).astype(float),
+        'timestamp': np.repeat(timestamps, N_SENSORS),
+        'vehicle_count': rng.integers(0, 30, n).astype(float),
+        'report_id': np.tile(np.arange(N_SENSORS), len(timestamps)),
+        'dataset_id': 1,
+    })
+
+def query_ms(session, start, end):
+    times = []
+    for _ in range(N_REPEATS):
+        t = time.perf_counter()
+        query.traffic_for_sensor(0, start, end, session=session, use_cache=False)
+        times.append((time.perf_counter() - t) * 1000)
+    return statistics.median(times)
+
+def run(layout, partitioned_tables):
+    os.environ['SQLITE_DB_FILE'] = os.path.join(tmp_dir, f'{layout}.db')
+    os.environ['PARTITIONED_TABLES'] = partitioned_tables
+    database.get_engine.cache_clear()
+    models.create_tables()
+    rng = np.random.default_rng(0)
+    months = pd.date_range('2014-01-01', periods=N_MONTHS, freq='MS')
+    insert_times = []
+    session = database.Session()
+    for month in months:
+        df = make_month(month, rng)
+        start = time.perf_counter()
+        pipeline.insert_rows_from_df(df, models.RoadTrafficData, session)
+        session.commit()
+        insert_times.append(time.perf_counter() - start)
+    day = months[-1] + pd.Timedelta(days=14)
+    result = (
+        len(df),
+        insert_times[0],
+        insert_times[-1],
+        query_ms(session, day, day + pd.Timedelta(days=1)),
+        query_ms(session, months[-1], months[-1] + pd.offsets.MonthBegin(1)),
+        )
+    session.close()
+    return result
+
+def main():
+    print(f"{N_MONTHS} months of {N_SENSORS} sensors every {READING_FREQ}")
+    print(f"{'':<12} {'rows/month':>10} {'first month':>12} {'last month':>11} {'day query':>10} {'month query':>12}")
+    for layout, partitioned_tables in (('single', ''), ('partitioned', 'road_traffic_data')):
+        n_rows, first, last, day_query, month_query = run(layout, partitioned_tables)
+        print(f"{layout:<12} {n_rows:>10} {first:11.2f}s {last:10.2f}s {day_query:8.2f}ms {month_query:10.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
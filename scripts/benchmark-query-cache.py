@@ -0,0 +1,80 @@
+"""
+Script benchmarking the query result cache against running the SQL directly.
+
+It looks up a day of road traffic readings for each sensor in a throwaway SQLite
+database populated with synthetic readings.
+"""
+
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+os.environ['SQLITE_DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+
+from sqlalchemy import text
+
+from citypulse_etl import models, query
+from citypulse_etl.database import Session
+
+N_SENSORS = 20
+N_READINGS_PER_SENSOR = 20_000
+N_REPEATS = 50
+START, END = pd.Timestamp('2014-03-01'), pd.Timestamp('2014-03-02')
+
+def populate(session):
+    rng = np.random.default_rng(0)
+    timestamps = pd.date_range('2014-02-13', periods=N_READINGS_PER_SENSOR, freq='5min').to_pydatetime()
+    for report_id in range(N_SENSORS):
+        session.execute(models.RoadTrafficData.__table__.insert(), [
+            dict(report_id=report_id, timestamp=t, avg_speed=s, vehicle_count=c)
+            for t, s, c in zip(
+                timestamps,
+                rng.integers(0, 90, N_READINGS_PER_SENSOR).tolist(),
+                rng.integers(0, 20, N_READINGS_PER_SENSOR).tolist(),
+                )
+            ])
+    models.IngestionRun.start(session)
+
+def timed_ms(fn):
+    times = []
+    for _ in range(N_REPEATS):
+        for report_id in range(N_SENSORS):
+            start = time.perf_counter()
+            fn(report_id)
+            times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def main():
+    models.create_tables()
+    session = Session()
+    populate(session)
+    session.commit()
+
+    sql = text(
+        "SELECT * FROM road_traffic_data WHERE report_id = :report_id "
+        "AND timestamp >= :start AND timestamp < :end ORDER BY timestamp"
+        )
+    def direct_sql(report_id):
+        return pd.read_sql(sql, session.connection(), params=dict(
+            report_id=report_id, start=str(START), end=str(END)))
+
+    def uncached(report_id):
+        return query.traffic_for_sensor(report_id, START, END, session=session, use_cache=False)
+
+    def cached(report_id):
+        return query.traffic_for_sensor(report_id, START, END, session=session)
+
+    print(f"{N_SENSORS} sensors x {N_READINGS_PER_SENSOR} readings, median latency of a one day lookup")
+    print(f"{'Direct SQL':<30} {timed_ms(direct_sql):8.3f}ms")
+    print(f"{'query (cache disabled)':<30} {timed_ms(uncached):8.3f}ms")
+    print(f"{'query (cache hit)':<30} {timed_ms(cached):8.3f}ms")
+
+    session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Script benchmarking `snapshot` with one dump worker against a thread pool.
+
+It loads synthetic road traffic and pollution readings into a throwaway SQLite
+database and reports the time of a whole snapshot (copy, dumps and checksums)
+with each number of workers. It then times the backup API copy while another
+process keeps inserting rows (in WAL journal mode), to show that loads carry on.
+"""
+
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+tmp_dir = tempfile.mkdtemp()
+os.environ['SQLITE_DB_FILE'] = os.path.join(tmp_dir, 'benchmark.db')
+os.environ['SQLITE_JOURNAL_MODE'] = 'WAL'
+
+from citypulse_etl import database, models, pipeline, snapshot
+
+N_ROWS = 500_000
+N_WORKERS = (1, 4)
+
+def make_traffic(n, start, rng):
+    return pd.DataFrame({
+        'status': pd.Categorical(np.where(rng.random(n) < 0.99, 'OK', 'ERROR')),
+        'avg_measured_time': rng.integers(30, 120, n).astype(float),
+        'avg_speed': rng.integers(20, 90, n).astype(float),
+        'ext_id': rng.integers(1000, 2000, n),
+        'median_measured_time': rng.integers(30, 120, n).astype(float),
+        'timestamp': pd.date_range(start, periods=n, freq='s'),
+        'vehicle_count': rng.integers(0, 30, n).astype(float),
+        'report_id': 1,
+        'dataset_id': 1,
+    })
+
+def make_pollution(n, rng):
+    return pd.DataFrame({
+        'ozone': rng.integers(0, 200, n),
+        'particullate_matter': rng.integers(0, 200, n),
+        'carbon_monoxide': rng.integers(0, 200, n),
+        'sulfure_dioxide': rng.integers(0, 200, n),
+        'nitrogen_dioxide': rng.integers(0, 200, n),
+        'longitude': rng.uniform(10.1, 10.3, n),
+        'latitude': rng.uniform(56.1, 56.2, n),
+        'geohash': 'u1zr2jf',
+        'timestamp': pd.date_range('2014-08-01', periods=n, freq='s'),
+        'dataset_id': 2,
+    })
+
+def load(rng):
+    models.create_tables()
+    session = database.Session()
+    pipeline.insert_rows_from_df(make_traffic(N_ROWS, '2014-01-01', rng), models.RoadTrafficData, session)
+    pipeline.insert_rows_from_df(make_pollution(N_ROWS, rng), models.PollutionData, session)
+    session.commit()
+    session.close()
+
+def keep_writing(stop, written):
+    rng = np.random.default_rng(1)
+    session = database.Session()
+    start = pd.Timestamp('2015-01-01')
+    while not stop.is_set():
+        pipeline.insert_rows_from_df(make_traffic(1000, start, rng), models.RoadTrafficData, session)
+        session.commit()
+        start += pd.Timedelta(seconds=1000)
+        written.value += 1000
+    session.close()
+
+def main():
+    rng = np.random.default_rng(0)
+    load(rng)
+    print(f"{N_ROWS} traffic and {N_ROWS} pollution rows, {os.path.getsize(os.environ['SQLITE_DB_FILE']) / 1e6:.0f}MB")
+    for n_workers in N_WORKERS:
+        start = time.perf_counter()
+        snapshot.create_snapshot(os.path.join(tmp_dir, f'snapshot-{n_workers}'), max_workers=n_workers)
+        print(f"snapshot with {n_workers} worker(s): {time.perf_counter() - start:.2f}s")
+    stop, written = multiprocessing.Event(), multiprocessing.Value('i', 0)
+    writer = multiprocessing.Process(target=keep_writing, args=(stop, written))
+    writer.start()
+    while written.value == 0:
+        time.sleep(0.1)
+    before = written.value
+    start = time.perf_counter()
+    snapshot.backup_database(os.environ['SQLITE_DB_FILE'], os.path.join(tmp_dir, 'copy.db'))
+    copy_time = time.perf_counter() - start
+    during = written.value - before
+    stop.set()
+    writer.join()
+    print(f"copy during a load: {copy_time:.2f}s, with {during} rows committed meanwhile")
+
+
+if __name__ == '__main__':
+    main()
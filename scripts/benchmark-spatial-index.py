@@ -0,0 +1,88 @@
+"""
+Script benchmarking the R*Tree spatial index against brute-force distance scans.
+
+It answers "which pollution readings lie within 500m of each traffic sensor" for
+synthetic points scattered around Aarhus, using a throwaway SQLite database.
+"""
+
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+
+os.environ['SQLITE_DB_FILE'] = os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+
+from citypulse_etl import models, spatial
+from citypulse_etl.database import Session
+
+N_READINGS = 200_000
+N_SENSORS = 50
+RADIUS_M = 500
+
+def random_points(rng, n):
+    return 56.10 + rng.random(n) * 0.15, 10.10 + rng.random(n) * 0.15
+
+def python_haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * spatial.EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+def timed(label, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f"{label:<40} {time.perf_counter() - start:8.3f}s")
+    return result
+
+def main():
+    rng = np.random.default_rng(0)
+    models.create_tables()
+    session = Session()
+
+    lats, lons = random_points(rng, N_READINGS)
+    session.execute(
+        models.PollutionData.__table__.insert(),
+        [dict(latitude=lat, longitude=lon) for lat, lon in zip(lats.tolist(), lons.tolist())],
+        )
+    timed("Building R*Tree index", lambda: spatial.rebuild_spatial_index(models.PollutionData, session))
+    session.commit()
+
+    sensors = list(zip(*random_points(rng, N_SENSORS)))
+
+    def python_loop():
+        points = session.query(models.PollutionData.latitude, models.PollutionData.longitude).all()
+        return [
+            sum(python_haversine(s_lat, s_lon, lat, lon) <= RADIUS_M for lat, lon in points)
+            for s_lat, s_lon in sensors
+            ]
+
+    def numpy_scan():
+        points = session.query(models.PollutionData.latitude, models.PollutionData.longitude).all()
+        p_lats, p_lons = np.array(points).T
+        return [
+            int((spatial.haversine_distance(s_lat, s_lon, p_lats, p_lons) <= RADIUS_M).sum())
+            for s_lat, s_lon in sensors
+            ]
+
+    def rtree_lookup():
+        return [
+            len(spatial.within_radius(models.PollutionData, s_lat, s_lon, RADIUS_M, session))
+            for s_lat, s_lon in sensors
+            ]
+
+    print(f"{N_SENSORS} sensors x {N_READINGS} readings, {RADIUS_M}m radius")
+    expected = timed("Brute force (python loop)", python_loop)
+    assert timed("Brute force (numpy scan)", numpy_scan) == expected
+    assert timed("R*Tree radius lookup", rtree_lookup) == expected
+    timed("R*Tree 5 nearest neighbours", lambda: [
+        spatial.nearest(models.PollutionData, s_lat, s_lon, session, k=5)
+        for s_lat, s_lon in sensors
+        ])
+
+    session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Script benchmarking the start up time of the `citypulse-etl` command.
+
+It reports the cumulative import time of the CLI module (from `python -X importtime`),
+the slowest imports it pulls in, and the wall-clock time of some quick invocations.
+"""
+
+import subprocess
+import sys
+import time
+
+N_RUNS = 5
+
+def import_times(module: str):
+    """Returns {module: cumulative import time in ms} for importing `module`"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+        )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+def best_wall_time(args):
+    best = float('inf')
+    for _ in range(N_RUNS):
+        start = time.perf_counter()
+        subprocess.run(args, capture_output=True)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main():
+    # Modules imported by the interpreter at start up regardless
+    startup_modules = set(import_times('sys'))
+    for module in ('citypulse_etl.cli', 'citypulse_etl.pipeline'):
+        times = import_times(module)
+        print(f"import {module}: {times[module]:.1f}ms")
+        imported = [(n, ms) for n, ms in times.items() if n not in startup_modules and n != module]
+        for name, ms in sorted(imported, key=lambda t: -t[1])[:5]:
+            print(f"    {name:<40} {ms:8.1f}ms")
+
+    print(f"python -c pass: {best_wall_time([sys.executable, '-c', 'pass']):.1f}ms (best of {N_RUNS})")
+    for args in (['--help'], ['clean-raw-files']):
+        cmd = [sys.executable, '-c', 'from citypulse_etl.cli import main; main()', *args]
+        print(f"citypulse-etl {' '.join(args)}: {best_wall_time(cmd):.1f}ms (best of {N_RUNS})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Script comparing event tables with their large text stored inline against the
+text being compressed into `text_payloads`.
+
+It builds synthetic cultural events with a few KB of HTML each, then reports the
+size of the `cultural_event_data` table and the time of a timestamp range scan
+which never reads the text, for both layouts.
+"""
+
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+tmp_dir = tempfile.mkdtemp()
+os.environ['SQLITE_DB_FILE'] = os.path.join(tmp_dir, 'benchmark.db')
+
+from sqlalchemy import Column, MetaData, String, Table, create_engine, text
+
+from citypulse_etl import models, pipeline
+from citypulse_etl.database import Session
+
+N_ROWS = 50_000
+N_REPEATS = 20
+SCAN_SQL = text(
+    "SELECT count(*), avg(latitude) FROM cultural_event_data "
+    "WHERE timestamp >= '2014-09-01' AND timestamp < '2014-10-01'"
+    )
+
+def make_rows():
+    rng = np.random.default_rng(0)
+    words = np.array(['koncert', 'musik', 'salen', 'billetter', 'aarhus', 'program', 'pause', 'orkester'])
+    return pd.DataFrame({
+        'name': [f'Event {i}' for i in range(N_ROWS)],
+        'event_id': [str(i) for i in range(N_ROWS)],
+        'city': 'Aarhus C',
+        'event_type': 'Musik',
+        'genre': 'Klassisk',
+        'xml': [
+            '<p>' + ' '.join(rng.choice(words, 500)) + '</p>'
+            for _ in range(N_ROWS)
+            ],
+        'timestamp': pd.date_range('2014-08-01', periods=N_ROWS, freq='5min'),
+        'latitude': rng.uniform(56.1, 56.2, N_ROWS),
+        'longitude': rng.uniform(10.1, 10.3, N_ROWS),
+    })
+
+def table_bytes(conn, name):
+    return conn.execute(text("SELECT sum(pgsize) FROM dbstat WHERE name = :name"), dict(name=name)).scalar()
+
+def scan_ms(conn):
+    times = []
+    for _ in range(N_REPEATS):
+        start = time.perf_counter()
+        conn.execute(SCAN_SQL).all()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def inline_layout(df):
+    # Baseline: the same table with the text stored inline
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, 'inline.db')}")
+    stored = {
+        **models.encoded_columns(models.CulturalEventData),
+        **models.offloaded_digest_columns(models.CulturalEventData),
+        }
+    metadata = MetaData()
+    table = Table('cultural_event_data', metadata, *[
+        Column(stored[c.name], String) if c.name in stored
+        else Column(c.name, c.type, primary_key=c.primary_key)
+        for c in models.CulturalEventData.__table__.c
+        ])
+    metadata.create_all(engine)
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(table.insert(), df.to_dict(orient='records'))
+    insert_time = time.perf_counter() - start
+    with engine.connect() as conn:
+        return insert_time, table_bytes(conn, 'cultural_event_data'), 0, scan_ms(conn)
+
+def offloaded_layout(df):
+    models.create_tables()
+    session = Session()
+    start = time.perf_counter()
+    pipeline.insert_rows_from_df(df, models.CulturalEventData, session)
+    session.commit()
+    insert_time = time.perf_counter() - start
+    conn = session.connection()
+    result = (
+        insert_time,
+        table_bytes(conn, 'cultural_event_data'),
+        table_bytes(conn, 'text_payloads'),
+        scan_ms(conn),
+        )
+    session.close()
+    return result
+
+def main():
+    df = make_rows()
+    print(f"{N_ROWS} events with ~{int(df['xml'].str.len().mean())} characters of xml each")
+    print(f"{'':<10} {'insert':>9} {'event table':>12} {'payloads':>10} {'scan':>10}")
+    for name, layout in (('inline', inline_layout), ('offloaded', offloaded_layout)):
+        insert_time, event_bytes, payload_bytes, scan = layout(df)
+        print(f"{name:<10} {insert_time:8.2f}s {event_bytes / 1e6:10.1f}MB "
+              f"{payload_bytes / 1e6:8.1f}MB {scan:8.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
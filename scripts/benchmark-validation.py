@@ -0,0 +1,69 @@
+"""
+Script benchmarking the cost of the row validation stage on large files.
+
+It times transforming a synthetic road traffic file of raw rows, with and
+without `validation.check_rows` beforehand, including a small share of rows
+which fail validation.
+"""
+
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+
+from citypulse_etl import models, validation
+
+N_ROWS = 1_000_000
+N_BAD_ROWS = 1_000
+N_REPEATS = 15
+
+class Dataset:
+    id = 1
+
+def make_raw_data():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'status': pd.Categorical(['OK'] * N_ROWS),
+        'avgMeasuredTime': rng.integers(10, 100, N_ROWS),
+        'avgSpeed': rng.integers(0, 90, N_ROWS),
+        'extID': 668,
+        'medianMeasuredTime': rng.integers(10, 100, N_ROWS),
+        'TIMESTAMP': pd.date_range('2014-02-13', periods=N_ROWS, freq='5min').strftime('%Y-%m-%dT%H:%M:%S'),
+        'vehicleCount': rng.integers(0, 20, N_ROWS),
+        '_id': np.arange(N_ROWS),
+        'REPORT_ID': 158355,
+    })
+    bad_rows = rng.choice(N_ROWS, N_BAD_ROWS, replace=False)
+    df.loc[bad_rows, 'avgSpeed'] = -1
+    return df
+
+def timed(fns, raw_data):
+    # Runs alternate between the functions, so drift in the machine's speed
+    # affects them alike
+    times = [[] for _ in fns]
+    for _ in range(N_REPEATS):
+        for fn, fn_times in zip(fns, times):
+            df = raw_data.copy()
+            start = time.perf_counter()
+            fn(df)
+            fn_times.append(time.perf_counter() - start)
+    return [statistics.median(fn_times) for fn_times in times]
+
+def transform(df):
+    models.RoadTrafficData.transform_raw_data(df, Dataset)
+
+def validate_and_transform(df):
+    df, rejects = validation.check_rows(df, models.RoadTrafficData)
+    models.RoadTrafficData.transform_raw_data(df, Dataset)
+
+def main():
+    raw_data = make_raw_data()
+    print(f"{N_ROWS} rows ({N_BAD_ROWS} invalid), median of {N_REPEATS} runs")
+    baseline, validated = timed([transform, validate_and_transform], raw_data)
+    print(f"{'transform':<25} {baseline:8.3f}s")
+    print(f"{'check_rows + transform':<25} {validated:8.3f}s ({(validated / baseline - 1) * 100:+.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
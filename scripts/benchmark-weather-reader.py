@@ -0,0 +1,78 @@
+"""
+Script benchmarking the weather `.txt` reader against the previous one, which
+built a dict per reading.
+
+It writes synthetic weather files spanning several months (one JSON object of
+timestamped readings per day, as in the CityPulse archives) and reports the
+time and peak memory of reading each.
+"""
+
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from citypulse_etl import models
+
+N_MONTHS = (3, 6, 12)
+READINGS_PER_DAY = 24 * 12  # every 5 minutes
+N_REPEATS = 3
+
+def legacy_read(fname):
+    variable = os.path.split(fname)[-1].split('.')[0]
+    data = []
+    with open(fname, 'r') as f:
+        for line in f.readlines():
+            data.extend([
+                {'timestamp': t, variable: float(v) if v else None}
+                for t,v in json.loads(line).items()
+                ])
+    return pd.DataFrame.from_records(data)
+
+def read(fname):
+    return models.read_weather_json_raw_data(models.WeatherData, fname)
+
+def write_file(n_months, tmp_dir):
+    rng = np.random.default_rng(0)
+    fname = os.path.join(tmp_dir, f'{n_months}', 'tempm.txt')
+    os.makedirs(os.path.dirname(fname))
+    with open(fname, 'w') as f:
+        for day in pd.date_range('2014-02-13', periods=n_months * 30, freq='D'):
+            timestamps = pd.date_range(day, periods=READINGS_PER_DAY, freq='5min').astype(str)
+            values = np.round(rng.normal(10, 5, READINGS_PER_DAY), 1).astype(str)
+            values[rng.random(READINGS_PER_DAY) < 0.05] = ''
+            f.write(json.dumps(dict(zip(timestamps, values))) + '\n')
+    return fname
+
+def measure(fn, fname):
+    times = []
+    for _ in range(N_REPEATS):
+        start = time.perf_counter()
+        fn(fname)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    fn(fname)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times), peak
+
+def main():
+    tmp_dir = tempfile.mkdtemp()
+    print(f"JSON parser: {models.json_loads.__module__}")
+    print(f"{'months':<8} {'readings':>10} {'reader':<8} {'time':>9} {'peak memory':>12}")
+    for n_months in N_MONTHS:
+        fname = write_file(n_months, tmp_dir)
+        n_readings = len(read(fname))
+        pd.testing.assert_frame_equal(read(fname), legacy_read(fname))
+        for name, fn in (('legacy', legacy_read), ('mmap', read)):
+            elapsed, peak = measure(fn, fname)
+            print(f"{n_months:<8} {n_readings:>10} {name:<8} {elapsed:8.3f}s {peak / 1e6:10.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,49 +2,32 @@
 Script demonstrating how to convert longitude and latitude into an address.
 
 It assumes that the database has been initialised and populated at least the metadata.
+Addresses are resolved with the Nominatim API through the on-disk geocoding cache,
+so re-running the script doesn't repeat any requests.
 """
 
-import requests
-
 from citypulse_etl.database import Session
+from citypulse_etl.geocoding import (
+    GeocodingCache,
+    NominatimProvider,
+    format_address,
+    resolve_addresses,
+)
 from citypulse_etl.models import TrafficSensor
 
-def get_address_from_longitude_latitude(lon, lat):
-    """
-    Uses the Nominatim API to do a reverse geocode on a longitude and latitude
-    then returns a human readable string of the address.
-    """
-    r = requests.get(
-        'https://nominatim.openstreetmap.org/reverse?',
-        params=dict(lon=lon, lat=lat, format='json'),
-        )
-    d = r.json().get('address')
-
-    if d is None:
-        return 'No address found'
-
-    road = d.get('road')
-    town_or_city = d.get('town', d.get('city'))
-    postcode = d.get('postcode')
-    country = d.get('country')
-    address = f"{road}, {town_or_city} {postcode}, {country}"
-
-    return address
-
-def print_traffic_sensor_points_in_human_readable_format(ts: TrafficSensor):
+def print_traffic_sensor_points_in_human_readable_format(ts: TrafficSensor, addresses, cache):
     """
     Prints the addresses of the two points associated with a TrafficSensor.
-    Note, this could simply be added as a method on the TrafficSensor class.
     """
-    point_1_address = get_address_from_longitude_latitude(
-        ts.point_1_longitude,
+    point_1_address = format_address(addresses.get(cache.key(
         ts.point_1_latitude,
-    )
+        ts.point_1_longitude,
+    )))
 
-    point_2_address = get_address_from_longitude_latitude(
-        ts.point_2_longitude,
+    point_2_address = format_address(addresses.get(cache.key(
         ts.point_2_latitude,
-    )
+        ts.point_2_longitude,
+    )))
 
     print(f"Traffic Sensor #{ts.id} measures traffic between:")
     print(f"    {point_1_address}")
@@ -54,10 +37,17 @@ def print_traffic_sensor_points_in_human_readable_format(ts: TrafficSensor):
 
 def main():
     session = Session()
+    cache = GeocodingCache()
+
+    sensors = session.query(TrafficSensor).limit(5).all()
+    points = [(ts.point_1_latitude, ts.point_1_longitude) for ts in sensors] + \
+        [(ts.point_2_latitude, ts.point_2_longitude) for ts in sensors]
+    addresses = resolve_addresses(points, NominatimProvider(), cache)
 
-    for ts in session.query(TrafficSensor).limit(5).all():
-        print_traffic_sensor_points_in_human_readable_format(ts)
+    for ts in sensors:
+        print_traffic_sensor_points_in_human_readable_format(ts, addresses, cache)
 
+    cache.close()
     session.close()
 
 
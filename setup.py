@@ -11,6 +11,7 @@ setup(
     url = "https://gitlab.com/s-a-m/citypulse-etl",
     package_dir={'':'src'},
     packages=['citypulse_etl'],
+    package_data={'citypulse_etl': ['data_types.json']},
     long_description=open(os.path.join(os.path.dirname(__file__), 'README.md')).read(),
     classifiers=[
         "Programming Language :: Python :: 3",
@@ -1,8 +1,9 @@
 import logging
 import sys
 
-logging.basicConfig(
-    stream=sys.stdout,
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s %(module)s - %(message)s'
-    )
+def configure_logging():
+    logging.basicConfig(
+        stream=sys.stdout,
+        level=logging.INFO,
+        format='[%(asctime)s] %(levelname)s %(module)s - %(message)s'
+        )
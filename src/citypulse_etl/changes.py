@@ -0,0 +1,62 @@
+"""
+Change log of the rows each `run-pipeline` run inserted, so downstream jobs can
+process only the rows added since the last run they saw
+"""
+
+import pandas as pd
+
+from datetime import datetime
+from typing import Tuple
+
+from sqlalchemy import and_, select
+
+from .database import Session
+from .models import ChangeLogEntry, Dataset, IngestionRun, decoded_select
+
+import logging
+log = logging.getLogger(__name__)
+
+def record_changes(
+    run_id: int,
+    data_type_cls,
+    dataset: Dataset,
+    fname: str,
+    id_range: Tuple[int, int],
+    session: Session,
+    ):
+    min_id, max_id = id_range
+    session.add(ChangeLogEntry(
+        run_id=run_id,
+        table_name=data_type_cls.__tablename__,
+        dataset_id=dataset.id,
+        file_name=fname,
+        min_id=min_id,
+        max_id=max_id,
+        row_count=max_id - min_id + 1,
+        logged_at=datetime.now(),
+        ))
+
+def _finished_changes_since(run_id: int):
+    # Runs still loading are left out, so a consumer that remembers the last
+    # run it saw doesn't miss the rest of a run it saw part of. Failed runs
+    # are included, as the files they committed stay loaded.
+    return select(ChangeLogEntry).join(IngestionRun, IngestionRun.id == ChangeLogEntry.run_id).where(
+        ChangeLogEntry.run_id > run_id,
+        IngestionRun.finished_at.is_not(None),
+        )
+
+def changes_since(run_id: int, session: Session) -> pd.DataFrame:
+    """The id ranges of rows inserted by the finished runs after `run_id`"""
+    query = _finished_changes_since(run_id).order_by(ChangeLogEntry.id)
+    return pd.read_sql(query, session.connection())
+
+def changed_rows(data_type_cls, run_id: int, session: Session) -> pd.DataFrame:
+    """The rows of a data type inserted by the finished runs after `run_id`"""
+    changes = _finished_changes_since(run_id).where(
+        ChangeLogEntry.table_name == data_type_cls.__tablename__).subquery()
+    t = data_type_cls.__table__.alias('t')
+    query = decoded_select(data_type_cls, t).join(changes, and_(
+        t.c.id >= changes.c.min_id,
+        t.c.id <= changes.c.max_id,
+        )).order_by(t.c.id)
+    return pd.read_sql(query, session.connection())
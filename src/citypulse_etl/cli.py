@@ -1,12 +1,16 @@
 """Main `citypulse-etl` command for running the ETL pipeline"""
 
+# The heavy dependencies (pandas, SQLAlchemy, requests, ...) are only imported
+# by the tasks that need them, to keep the command quick to start.
+
 import json
 import os
 import shutil
 
-from typing import Dict, List
+from typing import Dict, List, Union
 
-from citypulse_etl import pipeline, models, metadata
+from citypulse_etl import configure_logging
+from citypulse_etl.utils import load_env
 
 import logging
 log = logging.getLogger(__name__)
@@ -14,47 +18,154 @@ log = logging.getLogger(__name__)
 import argparse
 parser = argparse.ArgumentParser(description='Run the City Pulse ETL Pipeilne.')
 parser.add_argument('tasks', nargs='*', type=str,
-                    help='task(s) to perform, i.e. `clean-db` / `init-metadata` / `clean-raw-files` / `run-pipeline`')
+                    help='task(s) to perform, i.e. `clean-db` / `init-metadata` / `clean-raw-files` / `run-pipeline` / `rebuild-rollups` / `rebuild-spatial-indexes` / `rebuild-traffic-pollution` / `geocode-metadata` / `snapshot` / `restore-snapshot` / `changes-since`')
 parser.add_argument('--dataset-json', type=str, help='json file of datasets to process')
 parser.add_argument('--metadata-json', type=str, help='json file of metadata files')
 parser.add_argument('--skip-download', action='store_true', default=False,
                     help='skip downloading files')
+parser.add_argument('--commit-interval', type=str, default='file',
+                    help='commit after each `file`, each `dataset`, or every N rows (default: file)')
+parser.add_argument('--gazetteer-csv', type=str,
+                    help='local gazetteer csv to reverse geocode with instead of Nominatim')
+parser.add_argument('--refresh', action='store_true', default=False,
+                    help='re-resolve metadata addresses that have already been geocoded')
+parser.add_argument('--snapshot-dir', type=str,
+                    help='directory to write a snapshot to (default: a timestamped one in `snapshots` beside the database) or restore it from')
+parser.add_argument('--run-id', type=int, default=0,
+                    help='ingestion run to list the changes since (default: 0, all runs)')
+parser.add_argument('--snapshot-format', type=str, default='csv',
+                    help='format of the snapshot table dumps, `csv` (gzipped) or `parquet` (default: csv)')
 
 def clear_database():
+    load_env()
     db_file = os.getenv('SQLITE_DB_FILE')
     if os.path.exists(db_file): os.remove(db_file)
     open(db_file, 'a').close()
     log.info(f"Database cleared.")
 
 def init_database(clear_first=True):
+    from citypulse_etl import models, spatial
+    from citypulse_etl.database import Session
     if clear_first: clear_database()
     models.create_tables()
+    session = Session()
+    spatial.create_spatial_indexes(session)
+    session.close()
     log.info(f"Database initialised.")
 
 def init_metadata(md_dicts):
+    from citypulse_etl import metadata
     for md_dict in md_dicts:
         metadata.initialise_metadata(md_dict)
     log.info(f"Metadata initialised.")
 
 def clear_raw_data_files():
+    load_env()
     raw_data_dir = os.getenv('RAW_DATA_DIR')
     if os.path.exists(raw_data_dir):
         shutil.rmtree(raw_data_dir)
     os.makedirs(raw_data_dir)
     log.info(f'Raw data cleared.')
 
-def run_pipelines(dataset_dicts: List[Dict], skip_download: bool = False):
-    for ds_dict in dataset_dicts:
-        if ds_dict.get('ignore', False):
-            log.info(f"Ignoring for dataset: {ds_dict['name']}")
-            continue
-        log.info(f"Running pipeline for dataset: {ds_dict['name']}")
-        pipeline.run_pipeline(
-            ds_dict,
-            skip_download=skip_download,
-            )
+def run_pipelines(
+    dataset_dicts: List[Dict],
+    skip_download: bool = False,
+    commit_interval: Union[str, int] = 'file',
+    ):
+    from citypulse_etl import pipeline
+    from citypulse_etl.database import Session
+    from citypulse_etl.dedupe import RowFingerprints
+    from citypulse_etl.models import IngestionRun
+    fingerprints = RowFingerprints()  # shared so rows are deduplicated across datasets
+    session = Session()
+    run = IngestionRun.start(session)
+    run_id = run.id  # read before the commit, as reloading it would reopen a transaction
+    log.info(f"Starting ingestion run: {run_id}")
+    session.commit()  # don't hold the read transaction open during the load
+    try:
+        for ds_dict in dataset_dicts:
+            if ds_dict.get('ignore', False):
+                log.info(f"Ignoring for dataset: {ds_dict['name']}")
+                continue
+            log.info(f"Running pipeline for dataset: {ds_dict['name']}")
+            pipeline.run_pipeline(
+                ds_dict,
+                skip_download=skip_download,
+                commit_interval=commit_interval,
+                fingerprints=fingerprints,
+                run_id=run_id,
+                )
+    except BaseException:
+        # Files committed before the failure stay loaded, so the run is closed
+        # out for its changes to be listed
+        log.error(f"Ingestion run {run_id} failed")
+        run.finish(session, status='failed')
+        raise
+    else:
+        run.finish(session)
+    finally:
+        session.close()
+
+def rebuild_rollups():
+    from citypulse_etl import rollups
+    from citypulse_etl.database import Session
+    session = Session()
+    rollups.rebuild_rollups(session)
+    session.close()
+    log.info(f"Rollups rebuilt.")
+
+def rebuild_spatial_indexes():
+    from citypulse_etl import spatial
+    from citypulse_etl.database import Session
+    session = Session()
+    spatial.rebuild_spatial_indexes(session)
+    session.close()
+    log.info(f"Spatial indexes rebuilt.")
+
+def rebuild_traffic_pollution():
+    from citypulse_etl import joins
+    from citypulse_etl.database import Session
+    session = Session()
+    joins.rebuild_traffic_pollution(session)
+    session.close()
+    log.info(f"Traffic / pollution join rebuilt.")
+
+def geocode_metadata(gazetteer_csv: str = None, refresh: bool = False):
+    from citypulse_etl import geocoding
+    from citypulse_etl.database import Session
+    if gazetteer_csv is not None:
+        provider = geocoding.GazetteerProvider(gazetteer_csv)
+    else:
+        provider = geocoding.NominatimProvider()
+    cache = geocoding.GeocodingCache()
+    session = Session()
+    geocoding.geocode_traffic_sensors(provider, cache, session, refresh=refresh)
+    session.close()
+    cache.close()
+    log.info(f"Metadata geocoded.")
+
+def snapshot_database(snapshot_dir: str = None, snapshot_format: str = 'csv'):
+    from citypulse_etl import snapshot
+    if snapshot_dir is None:
+        snapshot_dir = snapshot.default_snapshot_dir()
+    snapshot.create_snapshot(snapshot_dir, snapshot_format=snapshot_format)
+
+def restore_database(snapshot_dir: str):
+    from citypulse_etl import snapshot
+    snapshot.restore_snapshot(snapshot_dir)
+
+def list_changes_since(run_id: int = 0):
+    from citypulse_etl import changes
+    from citypulse_etl.database import Session
+    session = Session()
+    df = changes.changes_since(run_id, session)
+    session.close()
+    log.info(f"{len(df)} change(s) since run {run_id}, {df['row_count'].sum()} row(s).")
+    if not df.empty:
+        print(df.to_json(orient='records', lines=True, date_format='iso'))
 
 def main():
+    configure_logging()
     args = parser.parse_args()
     if len(args.tasks) == 0:
         log.error(f"No tasks provided.")
@@ -72,6 +183,30 @@ def main():
                 log.error(f"--dataset-json option required to run pipeline")
                 continue
             dataset_dicts = json.load(open(args.dataset_json))
-            run_pipelines(dataset_dicts, skip_download=args.skip_download)
+            commit_interval = args.commit_interval
+            if commit_interval.isdigit():
+                commit_interval = int(commit_interval)
+            run_pipelines(
+                dataset_dicts,
+                skip_download=args.skip_download,
+                commit_interval=commit_interval,
+                )
+        elif task == 'rebuild-rollups':
+            rebuild_rollups()
+        elif task == 'rebuild-spatial-indexes':
+            rebuild_spatial_indexes()
+        elif task == 'rebuild-traffic-pollution':
+            rebuild_traffic_pollution()
+        elif task == 'geocode-metadata':
+            geocode_metadata(gazetteer_csv=args.gazetteer_csv, refresh=args.refresh)
+        elif task == 'snapshot':
+            snapshot_database(snapshot_dir=args.snapshot_dir, snapshot_format=args.snapshot_format)
+        elif task == 'restore-snapshot':
+            if args.snapshot_dir is None:
+                log.error(f"--snapshot-dir option required to restore a snapshot")
+                continue
+            restore_database(args.snapshot_dir)
+        elif task == 'changes-since':
+            list_changes_since(run_id=args.run_id)
         else:
             log.error(f"Unknown task: {task}")
@@ -1,15 +1,66 @@
 """Database connection management"""
 
 import os
+import zlib
 
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from functools import lru_cache
 
-load_dotenv()
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session as _Session
 
-DB_CONNECTION_STRING = f"{os.getenv('DB_CONNECTION_DRIVER')}:///{os.getenv('SQLITE_DB_FILE')}"
+from .utils import load_env
 
-db_engine = create_engine(DB_CONNECTION_STRING)
+SQLITE_JOURNAL_MODE = 'WAL'  # so loads carry on while a snapshot reads the database
+SQLITE_BUSY_TIMEOUT = 60  # seconds a connection waits for another's lock
 
-Session = sessionmaker(bind=db_engine)
+def db_connection_string() -> str:
+    load_env()
+    return f"{os.getenv('DB_CONNECTION_DRIVER')}:///{os.getenv('SQLITE_DB_FILE')}"
+
+def _inflate(data):
+    return None if data is None else zlib.decompress(data).decode('utf-8')
+
+def _configure_sqlite(engine):
+    # pysqlite's own transaction handling doesn't start a transaction before a
+    # SAVEPOINT, so let SQLAlchemy emit BEGIN itself for savepoints to nest.
+    journal_mode = os.getenv('SQLITE_JOURNAL_MODE') or SQLITE_JOURNAL_MODE
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        # Decompresses `text_payloads` data in SQL, e.g. in `decoded_select`
+        dbapi_connection.create_function('inflate', 1, _inflate, deterministic=True)
+        dbapi_connection.execute(f"PRAGMA journal_mode={journal_mode}")
+
+    @event.listens_for(engine, 'begin')
+    def on_begin(conn):
+        conn.exec_driver_sql('BEGIN')
+
+@lru_cache(maxsize=None)
+def get_engine():
+    """Creates the database engine on first use, rather than at import"""
+    connection_string = db_connection_string()
+    connect_args = {'timeout': SQLITE_BUSY_TIMEOUT} if connection_string.startswith('sqlite') else {}
+    engine = create_engine(connection_string, connect_args=connect_args)
+    if engine.dialect.name == 'sqlite':
+        _configure_sqlite(engine)
+    return engine
+
+class Session(_Session):
+    """Database session, bound to the engine unless another bind is given"""
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('bind', get_engine())
+        super().__init__(**kwargs)
+
+def upsert_rows(table, records, index_elements, session):
+    """Inserts rows into `table`, updating any that clash on `index_elements`"""
+    if not records:
+        return
+    stmt = sqlite_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={k: stmt.excluded[k] for k in records[0] if k not in index_elements},
+        )
+    session.execute(stmt, records)
@@ -0,0 +1,144 @@
+"""Skipping of dataset files and rows which have already been loaded"""
+
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+
+from .database import Session
+from .models import Dataset, FileFingerprint, RowFingerprint, transformed_columns
+
+import logging
+log = logging.getLogger(__name__)
+
+BLOOM_FILTER_BITS = 2 ** 28  # 32MB
+BLOOM_FILTER_HASHES = 4
+LOAD_CHUNK_SIZE = 1_000_000
+LOOKUP_CHUNK_SIZE = 10_000
+
+def file_digest(fname: str, prefix: bytes = b'') -> str:
+    """sha256 hex digest of a file (after `prefix`), read in blocks"""
+    digest = hashlib.sha256(prefix)
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def dataset_file_digest(fname: str, data_type_cls) -> str:
+    """
+    Fingerprint of a dataset file: the digest of its table, base name and
+    contents, as readers take values from the name too (e.g. the sensor of a
+    pollution file or the variable of a weather file)
+    """
+    prefix = f"{data_type_cls.__tablename__}\0{os.path.basename(fname)}\0".encode()
+    return file_digest(fname, prefix)
+
+def find_loaded_file(digest: str, session: Session) -> Optional[FileFingerprint]:
+    return session.get(FileFingerprint, digest)
+
+def record_loaded_file(digest: str, fname: str, dataset: Dataset, session: Session):
+    session.add(FileFingerprint(
+        digest=digest,
+        dataset_id=dataset.id,
+        file_name=fname,
+        loaded_at=datetime.now(),
+        ))
+
+def row_fingerprints(df: pd.DataFrame, data_type_cls) -> np.ndarray:
+    """64 bit hashes of the values of transformed rows, which differ between tables"""
+    values = df[[c for c in transformed_columns(data_type_cls) if c != 'dataset_id']]
+    # Normalise numeric columns, which may be read as ints in one file and floats in another
+    values = values.astype({
+        c: 'float64' for c in values.columns
+        if pd.api.types.is_numeric_dtype(values[c]) and not pd.api.types.is_bool_dtype(values[c])
+        })
+    table_hash = int.from_bytes(
+        hashlib.blake2b(data_type_cls.__tablename__.encode(), digest_size=8).digest(), 'little')
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy() ^ np.uint64(table_hash)
+    return hashes.view(np.int64)  # as stored in SQLite's signed integers
+
+
+class BloomFilter:
+    """Fixed size set of 64 bit hashes, which may report false positives but not false negatives"""
+
+    def __init__(self, n_bits: int = BLOOM_FILTER_BITS, n_hashes: int = BLOOM_FILTER_HASHES):
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+        self._bits = np.zeros((n_bits + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, hashes: np.ndarray) -> np.ndarray:
+        # Derives each position from two halves of the hash (double hashing)
+        hashes = hashes.view(np.uint64)
+        h1, h2 = hashes & np.uint64(0xffffffff), (hashes >> np.uint64(32)) | np.uint64(1)
+        i = np.arange(self.n_hashes, dtype=np.uint64)[:, None]
+        return (h1 + i * h2) % np.uint64(self.n_bits)
+
+    def add(self, hashes: np.ndarray):
+        positions = self._positions(hashes).ravel()
+        np.bitwise_or.at(self._bits, positions >> np.uint64(3), (1 << (positions & np.uint64(7))).astype(np.uint8))
+
+    def might_contain(self, hashes: np.ndarray) -> np.ndarray:
+        positions = self._positions(hashes)
+        bits = (self._bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return bits.all(axis=0)
+
+
+class RowFingerprints:
+    """
+    Fingerprints of the rows loaded so far. They're stored in `row_fingerprints`,
+    with a Bloom filter in memory so only likely duplicates are looked up there.
+    """
+
+    def __init__(self, n_bits: int = BLOOM_FILTER_BITS, n_hashes: int = BLOOM_FILTER_HASHES):
+        self.bloom_filter = BloomFilter(n_bits, n_hashes)
+        self._loaded = False
+
+    def _load(self, session: Session):
+        log.info("Loading row fingerprints...")
+        query = select(RowFingerprint.fingerprint)
+        for chunk in pd.read_sql(query, session.connection(), chunksize=LOAD_CHUNK_SIZE):
+            self.bloom_filter.add(chunk['fingerprint'].to_numpy(dtype=np.int64))
+        self._loaded = True
+
+    # These run through the driver as there can be millions of fingerprints per
+    # file, and in sorted order so SQLite walks its index sequentially.
+
+    def _stored(self, fingerprints: np.ndarray, session: Session) -> np.ndarray:
+        connection = session.connection()
+        candidates = np.sort(fingerprints)
+        stored = []
+        for i in range(0, len(candidates), LOOKUP_CHUNK_SIZE):
+            chunk = candidates[i:i + LOOKUP_CHUNK_SIZE].tolist()
+            stored.extend(f for f, in connection.exec_driver_sql(
+                f"SELECT fingerprint FROM row_fingerprints WHERE fingerprint IN ({','.join('?' * len(chunk))})",
+                tuple(chunk),
+                ))
+        return np.isin(fingerprints, np.array(stored, dtype=np.int64))
+
+    def _store(self, fingerprints: np.ndarray, session: Session):
+        session.connection().exec_driver_sql(
+            "INSERT INTO row_fingerprints (fingerprint) VALUES (?)",
+            [(f,) for f in np.sort(fingerprints).tolist()],
+            )
+
+    def drop_seen(self, df: pd.DataFrame, data_type_cls, session: Session) -> pd.DataFrame:
+        """Drops rows already loaded or repeated within `df`, and records the rest as loaded"""
+        if not self._loaded:
+            self._load(session)
+        fingerprints = row_fingerprints(df, data_type_cls)
+        duplicated = pd.Series(fingerprints).duplicated().to_numpy(copy=True)
+        maybe_seen = self.bloom_filter.might_contain(fingerprints) & ~duplicated
+        if maybe_seen.any():
+            duplicated[maybe_seen] = self._stored(fingerprints[maybe_seen], session)
+        new_fingerprints = fingerprints[~duplicated]
+        if len(new_fingerprints):
+            self._store(new_fingerprints, session)
+            self.bloom_filter.add(new_fingerprints)
+        if duplicated.any():
+            log.info(f"Skipped {duplicated.sum()} duplicate row(s)")
+        return df[~duplicated]
@@ -0,0 +1,264 @@
+"""Reverse geocoding of metadata coordinates with a persistent on-disk cache"""
+
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Optional, Tuple
+
+from .database import Session
+from .models import TrafficSensor
+from .spatial import haversine_distance
+from .utils import load_env
+
+import logging
+log = logging.getLogger(__name__)
+
+NOMINATIM_URL = 'https://nominatim.openstreetmap.org/reverse'
+MAX_ATTEMPTS = 4
+RETRY_BACKOFF = 2.0  # seconds before the first retry, doubling after each
+
+Point = Tuple[float, float]
+
+def _has_coordinates(latitude, longitude) -> bool:
+    return not (latitude is None or longitude is None or math.isnan(latitude) or math.isnan(longitude))
+
+def format_address(d: Optional[Dict]) -> str:
+    """Converts an address dict into a human readable string"""
+    if d is None:
+        return 'No address found'
+    road = d.get('road')
+    town_or_city = d.get('town', d.get('city'))
+    postcode = d.get('postcode')
+    country = d.get('country')
+    return f"{road}, {town_or_city} {postcode}, {country}"
+
+
+# Providers
+
+class GeocodingProvider(ABC):
+    """Interface for reverse geocoding services"""
+
+    @abstractmethod
+    def reverse(self, latitude: float, longitude: float) -> Optional[Dict]:
+        """Returns the address dict for a coordinate, or `None` if there isn't one"""
+
+
+class NominatimProvider(GeocodingProvider):
+    """Reverse geocoding with the Nominatim API (or any server implementing it)"""
+
+    def __init__(self, url: str = None, min_interval: float = None):
+        load_env()
+        self.url = url or os.getenv('NOMINATIM_URL', NOMINATIM_URL)
+        # The public server allows at most one request per second
+        if min_interval is None:
+            min_interval = 1.0 if self.url == NOMINATIM_URL else 0.0
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._last_request = 0.0
+
+    def _wait_for_turn(self):
+        with self._lock:
+            delay = self._last_request + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._last_request = time.monotonic()
+
+    def reverse(self, latitude, longitude):
+        self._wait_for_turn()
+        r = requests.get(
+            self.url,
+            params=dict(lat=latitude, lon=longitude, format='json'),
+            headers={'User-Agent': 'citypulse-etl'},
+            )
+        r.raise_for_status()
+        return r.json().get('address')
+
+
+class GazetteerProvider(GeocodingProvider):
+    """
+    Offline reverse geocoding against a local gazetteer CSV file with
+    `latitude`, `longitude`, `road`, `city`, `postcode` and `country` columns.
+    """
+
+    def __init__(self, fname: str, max_distance_m: float = 250.0):
+        self.gazetteer = pd.read_csv(fname, dtype=str)
+        self.max_distance_m = max_distance_m
+        self._latitudes = self.gazetteer['latitude'].to_numpy(float)
+        self._longitudes = self.gazetteer['longitude'].to_numpy(float)
+
+    def reverse(self, latitude, longitude):
+        if self.gazetteer.empty:
+            return None
+        distances = haversine_distance(latitude, longitude, self._latitudes, self._longitudes)
+        i = int(np.argmin(distances))
+        if distances[i] > self.max_distance_m:
+            return None
+        entry = self.gazetteer.iloc[i].drop(['latitude', 'longitude'])
+        return {k: v for k, v in entry.items() if pd.notna(v)}
+
+
+# Cache
+
+class GeocodingCache:
+    """
+    Persistent cache of reverse geocoding results keyed by coordinates rounded
+    to `precision` decimal places. Entries expire after `ttl` seconds and the
+    least recently used entries are evicted beyond `max_entries`.
+    """
+
+    def __init__(
+        self,
+        fname: str = None,
+        precision: int = 5,
+        ttl: float = 90 * 24 * 60 * 60,
+        max_entries: int = 100_000,
+        ):
+        load_env()
+        self.fname = fname or os.getenv('GEOCODING_CACHE_FILE', 'data/geocoding-cache.db')
+        self.precision = precision
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(self.fname) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(self.fname)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocodes ("
+            "latitude REAL, longitude REAL, address TEXT, created_at REAL, accessed_at REAL, "
+            "PRIMARY KEY (latitude, longitude))"
+            )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS geocodes_accessed_at ON geocodes (accessed_at)")
+
+    def key(self, latitude: float, longitude: float) -> Point:
+        return (round(latitude, self.precision), round(longitude, self.precision))
+
+    def get_many(self, keys: Iterable[Point]) -> Dict[Point, Optional[Dict]]:
+        """Returns the unexpired cached addresses for the keys that have one"""
+        now = time.time()
+        hits = {}
+        for k in keys:
+            row = self.conn.execute(
+                "SELECT address, created_at FROM geocodes WHERE latitude = ? AND longitude = ?", k,
+                ).fetchone()
+            if row is None:
+                continue
+            if row[1] + self.ttl < now:
+                self.conn.execute("DELETE FROM geocodes WHERE latitude = ? AND longitude = ?", k)
+                continue
+            hits[k] = json.loads(row[0])
+            self.conn.execute(
+                "UPDATE geocodes SET accessed_at = ? WHERE latitude = ? AND longitude = ?", (now, *k),
+                )
+        self.conn.commit()
+        return hits
+
+    def put_many(self, addresses: Dict[Point, Optional[Dict]]):
+        now = time.time()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?, ?, ?)",
+            [(*k, json.dumps(a), now, now) for k, a in addresses.items()],
+            )
+        self.conn.execute(
+            "DELETE FROM geocodes WHERE rowid IN ("
+            "SELECT rowid FROM geocodes ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+            )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+# Batch resolution
+
+def reverse_with_retries(
+    provider: GeocodingProvider,
+    key: Point,
+    max_attempts: int = MAX_ATTEMPTS,
+    backoff: float = RETRY_BACKOFF,
+    ) -> Optional[Dict]:
+    """Reverse geocodes a point, retrying failures (e.g. rate limiting) with exponential backoff"""
+    for attempt in range(max_attempts):
+        try:
+            return provider.reverse(*key)
+        except Exception as e:
+            if attempt == max_attempts - 1:
+                raise
+            delay = backoff * 2 ** attempt
+            log.debug(f"Reverse geocoding {key} failed ({e!r}), retrying in {delay}s")
+            time.sleep(delay)
+
+def resolve_addresses(
+    points: Iterable[Point],
+    provider: GeocodingProvider,
+    cache: GeocodingCache,
+    max_workers: int = 4,
+    max_attempts: int = MAX_ATTEMPTS,
+    backoff: float = RETRY_BACKOFF,
+    ) -> Dict[Point, Optional[Dict]]:
+    """
+    Reverse geocodes a collection of (latitude, longitude) points, returning
+    address dicts keyed by the cache key of each point. Shared coordinates are
+    only resolved once, and cache misses are resolved `max_workers` at a time
+    and cached as each is resolved. Points which still fail after retrying are
+    logged and left out, to be tried again next time.
+    """
+    keys = {cache.key(lat, lon) for lat, lon in points if _has_coordinates(lat, lon)}
+    addresses = cache.get_many(keys)
+    misses = sorted(keys.difference(addresses))
+    log.info(f"Resolving {len(keys)} unique coordinates ({len(misses)} not cached)...")
+    failed = []
+    if misses:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(reverse_with_retries, provider, k, max_attempts, backoff): k
+                for k in misses
+                }
+            for future in as_completed(futures):
+                k = futures[future]
+                try:
+                    address = future.result()
+                except Exception as e:
+                    log.warning(f"Failed to reverse geocode {k}: {e!r}")
+                    failed.append(k)
+                    continue
+                cache.put_many({k: address})
+                addresses[k] = address
+    if failed:
+        log.warning(f"{len(failed)} coordinate(s) couldn't be resolved")
+    return addresses
+
+def geocode_traffic_sensors(
+    provider: GeocodingProvider,
+    cache: GeocodingCache,
+    session: Session,
+    refresh: bool = False,
+    max_workers: int = 4,
+    ):
+    """Stores the addresses of both points of the traffic sensors on the metadata table"""
+    query = session.query(TrafficSensor)
+    if not refresh:
+        query = query.filter(
+            TrafficSensor.point_1_address.is_(None) | TrafficSensor.point_2_address.is_(None)
+            )
+    sensors = query.all()
+    points = [
+        (getattr(ts, f'{p}_latitude'), getattr(ts, f'{p}_longitude'))
+        for ts in sensors for p in ('point_1', 'point_2')
+        ]
+    addresses = resolve_addresses(points, provider, cache, max_workers=max_workers)
+    for ts in sensors:
+        for p in ('point_1', 'point_2'):
+            lat, lon = getattr(ts, f'{p}_latitude'), getattr(ts, f'{p}_longitude')
+            if not _has_coordinates(lat, lon) or cache.key(lat, lon) not in addresses:
+                continue
+            setattr(ts, f'{p}_address', format_address(addresses[cache.key(lat, lon)]))
+    session.commit()
@@ -0,0 +1,43 @@
+"""Vectorised geohash encoding of latitude / longitude columns"""
+
+import numpy as np
+
+GEOHASH_PRECISION = 7  # ~150m x 150m cells
+
+_BASE32 = np.array(list('0123456789bcdefghjkmnpqrstuvwxyz'))
+
+def _quantise(values, lower, upper, n_bits):
+    scaled = (values - lower) / (upper - lower) * (1 << n_bits)
+    return np.clip(scaled, 0, (1 << n_bits) - 1).astype(np.uint64)
+
+def encode_geohash(latitudes, longitudes, precision: int = GEOHASH_PRECISION) -> np.ndarray:
+    """
+    Encodes arrays of latitudes and longitudes into geohash strings.
+    Rows with a missing coordinate are encoded as `None`.
+    """
+    lat = np.asarray(latitudes, dtype=float)
+    lon = np.asarray(longitudes, dtype=float)
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+
+    n_bits = 5 * precision
+    lon_bits, lat_bits = (n_bits + 1) // 2, n_bits // 2
+    lon_int = _quantise(np.where(valid, lon, 0.0), -180.0, 180.0, lon_bits)
+    lat_int = _quantise(np.where(valid, lat, 0.0), -90.0, 90.0, lat_bits)
+
+    # Interleave the bits, starting with longitude
+    code = np.zeros(lat.shape, dtype=np.uint64)
+    for i in range(n_bits):
+        if i % 2 == 0:
+            bit = (lon_int >> np.uint64(lon_bits - 1 - i // 2)) & np.uint64(1)
+        else:
+            bit = (lat_int >> np.uint64(lat_bits - 1 - i // 2)) & np.uint64(1)
+        code = (code << np.uint64(1)) | bit
+
+    hashes = np.full(lat.shape, '', dtype=f'<U{precision}')
+    for j in range(precision):
+        idx = (code >> np.uint64(5 * (precision - 1 - j))) & np.uint64(31)
+        hashes = np.char.add(hashes, _BASE32[idx.astype(np.intp)])
+
+    hashes = hashes.astype(object)
+    hashes[~valid] = None
+    return hashes
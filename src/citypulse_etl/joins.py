@@ -0,0 +1,107 @@
+"""Functions for materialising the traffic / pollution space-time join"""
+
+import pandas as pd
+
+from typing import List, Tuple
+
+from sqlalchemy import delete, func, select
+
+from .database import Session, upsert_rows
+from .models import PollutionData, RoadTrafficData, TrafficPollutionData
+
+import logging
+log = logging.getLogger(__name__)
+
+# The two feeds tick at different cadences, so readings are paired with the
+# nearest reading of the other feed within this window.
+JOIN_TOLERANCE = pd.Timedelta(minutes=10)
+
+def _read_traffic(report_id, start, end, session: Session, id_range=None) -> pd.DataFrame:
+    t = RoadTrafficData.__table__
+    query = select(
+        t.c.id.label('traffic_id'),
+        t.c.report_id,
+        t.c.timestamp,
+        *[t.c[c] for c in TrafficPollutionData.traffic_columns],
+        ).where(
+        t.c.report_id == report_id,
+        t.c.timestamp.between(start, end),
+        )
+    if id_range is not None:
+        query = query.where(t.c.id.between(*id_range))
+    return pd.read_sql(query, session.connection(), parse_dates=['timestamp'])
+
+def _read_pollution(report_id, start, end, session: Session) -> pd.DataFrame:
+    p = PollutionData.__table__
+    query = select(
+        p.c.id.label('pollution_id'),
+        p.c.timestamp,
+        *[p.c[c] for c in TrafficPollutionData.pollution_columns],
+        ).where(
+        p.c.report_id == report_id,
+        p.c.timestamp.between(start - JOIN_TOLERANCE, end + JOIN_TOLERANCE),
+        )
+    return pd.read_sql(query, session.connection(), parse_dates=['timestamp'])
+
+def align_traffic_pollution(traffic: pd.DataFrame, pollution: pd.DataFrame) -> pd.DataFrame:
+    """Pairs each traffic reading with the nearest pollution reading within the tolerance"""
+    pollution = pollution.assign(pollution_timestamp=pollution['timestamp'])
+    merged = pd.merge_asof(
+        traffic.sort_values('timestamp'),
+        pollution.sort_values('timestamp'),
+        on='timestamp',
+        direction='nearest',
+        tolerance=JOIN_TOLERANCE,
+        )
+    merged = merged.dropna(subset=['pollution_id'])
+    merged['pollution_id'] = merged['pollution_id'].astype(int)
+    return merged[[c.name for c in TrafficPollutionData.__table__.c if c.name != 'id']]
+
+def _refresh_report(report_id, start, end, session: Session, traffic_id_range=None):
+    traffic = _read_traffic(report_id, start, end, session, id_range=traffic_id_range)
+    if traffic.empty:
+        return
+    pollution = _read_pollution(report_id, traffic['timestamp'].min(), traffic['timestamp'].max(), session)
+    if pollution.empty:
+        return
+    aligned = align_traffic_pollution(traffic, pollution)
+    records = aligned.astype(object).where(aligned.notna(), None).to_dict(orient='records')
+    upsert_rows(TrafficPollutionData.__table__, records, ['traffic_id'], session)
+
+def refresh_traffic_pollution(data_type_cls, id_ranges: List[Tuple[int, int]], session: Session):
+    """
+    Re-aligns the traffic readings affected by the traffic or pollution rows
+    inserted with the given (first, last) id ranges, one sensor at a time.
+    """
+    if data_type_cls not in (RoadTrafficData, PollutionData) or not id_ranges:
+        return
+    log.info(f"Refreshing {TrafficPollutionData.__tablename__}...")
+    # A dataset's files are inserted one after another, so the rows between
+    # its first and last new ids are all new
+    id_range = (min(first for first, _ in id_ranges), max(last for _, last in id_ranges))
+    t = data_type_cls.__table__
+    ranges = session.execute(
+        select(t.c.report_id, func.min(t.c.timestamp), func.max(t.c.timestamp))
+        .where(t.c.id.between(*id_range))
+        .group_by(t.c.report_id)
+        ).all()
+    for report_id, start, end in ranges:
+        if data_type_cls is RoadTrafficData:
+            # Only the new traffic rows need aligning
+            _refresh_report(report_id, start, end, session, traffic_id_range=id_range)
+        else:
+            # Any traffic rows near the new pollution rows may have a closer match
+            _refresh_report(report_id, start - JOIN_TOLERANCE, end + JOIN_TOLERANCE, session)
+
+def rebuild_traffic_pollution(session: Session):
+    """Recomputes the traffic / pollution join from scratch"""
+    log.info(f"Rebuilding {TrafficPollutionData.__tablename__}...")
+    session.execute(delete(TrafficPollutionData.__table__))
+    t = RoadTrafficData.__table__
+    ranges = session.execute(
+        select(t.c.report_id, func.min(t.c.timestamp), func.max(t.c.timestamp))
+        .group_by(t.c.report_id)
+        ).all()
+    for report_id, start, end in ranges:
+        _refresh_report(report_id, start, end, session)
+    session.commit()
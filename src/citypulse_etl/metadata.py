@@ -3,9 +3,10 @@
 import os
 import pandas as pd
 
-from .database import Session
+from .database import Session, upsert_rows
 from .models import metadata_registry
-from .utils import RAW_DATA_DIR, download_file, url_to_filename
+from .spatial import rebuild_spatial_index
+from .utils import download_file, raw_data_dir, url_to_filename
 
 import logging
 log = logging.getLogger(__name__)
@@ -21,12 +22,16 @@ def initialise_metadata(md_dict):
     download_file(url, fname)
 
     log.info("Read in metadata file...")
-    df = pd.read_csv(os.path.join(RAW_DATA_DIR, fname))
-    for r in df.to_dict(orient='records'):
-        md_record = md_cls.fromdict(r)
-        session.add(md_record)
+    df = md_cls.transform_raw_data(pd.read_csv(os.path.join(raw_data_dir(), fname)))
 
-    session.commit()
-    session.close()
+    # Upserting on the primary key keeps re-runs safe on a populated database,
+    # without touching columns that aren't in the file (e.g. geocoded addresses)
+    log.info(f"Writing to {md_cls.__tablename__}...")
+    records = df.astype(object).where(df.notna(), None).to_dict(orient='records')
+    primary_key = [c.name for c in md_cls.__table__.primary_key.columns]
+    upsert_rows(md_cls.__table__, records, primary_key, session)
 
+    rebuild_spatial_index(md_cls, session)
 
+    session.commit()
+    session.close()
@@ -1,21 +1,44 @@
 """Data model classes"""
 
 import os
+import re
 import json
+import mmap
+import zlib
+import hashlib
+import numpy as np
 import pandas as pd
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+from datetime import datetime
+
 from sqlalchemy import (
+    func,
+    select,
     Column,
     Integer,
     String,
     ForeignKey,
     Float,
     DateTime,
-    UniqueConstraint
+    LargeBinary,
+    MetaData,
+    Table,
+    UniqueConstraint,
+    event,
+    text,
 )
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session as _OrmSession, object_session
 
-from .database import db_engine
+from .database import get_engine
+from .geohash import encode_geohash
+from .partitions import create_partitioned_table, partitioned_table_names
 from .utils import url_to_filename, check_for_header
 
 import logging
@@ -23,488 +46,315 @@ log = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+def encoded_columns(cls):
+    """Maps the stored category id columns of a model to their decoded names"""
+    return {f'{c}_id': c for c in getattr(cls, 'categorical_columns', [])}
+
+def offloaded_digest_columns(cls):
+    """Maps the stored payload digest columns of a model to their text column names"""
+    return {f'{c}_digest': c for c in getattr(cls, 'offloaded_columns', [])}
+
+def transformed_columns(cls):
+    """Columns of the transformed data, which holds categories and text rather than their ids"""
+    stored = {**encoded_columns(cls), **offloaded_digest_columns(cls)}
+    return [stored.get(c.name, c.name) for c in cls.__table__.c if c.name != 'id']
+
+class OffloadedText:
+    """
+    Descriptor loading a model's text from `text_payloads` when it is accessed.
+    Text set on an instance is stored in `text_payloads` when it is flushed.
+    """
+
+    def __set_name__(self, owner, name):
+        self.digest_column = f'{name}_digest'
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        digest = getattr(instance, self.digest_column)
+        if digest is None:
+            return None
+        pending = instance.__dict__.get('_pending_payloads', {})
+        if digest in pending:
+            return pending[digest]
+        return TextPayload.load(digest, object_session(instance))
+
+    def __set__(self, instance, value):
+        if value is None:
+            setattr(instance, self.digest_column, None)
+            return
+        value = str(value)
+        digest = TextPayload.digest_text(value)
+        instance.__dict__.setdefault('_pending_payloads', {})[digest] = value
+        setattr(instance, self.digest_column, digest)
 
-# Primary Data Type Models
-
-class RoadTrafficData(Base):
-    """Road Traffic Data"""
-
-    __tablename__ = 'road_traffic_data'
-
-    # Column definitions
-    id = Column(Integer, primary_key=True)
-    status = Column(String)
-    avg_measured_time = Column(Float)
-    avg_speed = Column(Float)
-    ext_id = Column(Integer)
-    median_measured_time = Column(Float)
-    timestamp = Column(DateTime)
-    vehicle_count = Column(Float)
-    report_id = Column(Integer, ForeignKey('traffic_sensors.id'))
-    dataset_id = Column(Integer, ForeignKey('datasets.id'))
 
-    # Uniqueness constraints
-    __table_args__ = (
-        UniqueConstraint(
-            'timestamp',
-            'report_id',
-            name='_time_uc'
-            ),
-    )
-
-    raw_data_column_map = {
-        'status': 'status',
-        'avgMeasuredTime': 'avg_measured_time',
-        'avgSpeed': 'avg_speed',
-        'extID': 'ext_id',
-        'medianMeasuredTime': 'median_measured_time',
-        'TIMESTAMP': 'timestamp',
-        'vehicleCount': 'vehicle_count',
-        '_id': 'source_id',
-        'REPORT_ID': 'report_id',
-    }
-
-    @classmethod
-    def read_raw_data(cls, fname, dataset):
-        assert fname.endswith('.csv')
-        if check_for_header(fname):
-            return pd.read_csv(fname)
-        else:
-            return pd.read_csv(fname, names = cls.raw_data_column_map.keys())
-
-    
-    @classmethod
-    def validate_raw_data(cls, df):
-        missing_cols = set(cls.raw_data_column_map.keys()).difference(set(df.columns))
-        if missing_cols:
-            msg = f"Raw data missing columns: {missing_cols}"
-            log.error(msg)
-            raise ValueError(msg)
-
-    @classmethod
-    def transform_raw_data(cls, df, dataset):
-        df = df.drop_duplicates().reset_index(drop=True)
-        df['dataset_id'] = dataset.id
-        df = df.rename(columns=cls.raw_data_column_map)
-        df['timestamp']= pd.to_datetime(df['timestamp'])
-        return df[[c.name for c in cls.__table__.c if c.name != 'id']]
+# Primary Data Type Models
 
+DATA_TYPE_SPECS_FILE = os.path.join(os.path.dirname(__file__), 'data_types.json')
 
-class PollutionData(Base):
-    """Pollution Data"""
+_column_types = {
+    'integer': Integer,
+    'float': Float,
+    'string': String,
+    'datetime': DateTime,
+}
 
-    __tablename__ = 'pollution_data'
+def read_csv_raw_data(cls, fname):
+    if not fname.endswith('.csv'):
+        raise ValueError(f"{fname} is not a `.csv` file")
+    # Columns held as categories are read straight into that dtype
+    dtype = {
+        raw: 'category' for raw, c in cls.raw_data_column_map.items()
+        if c in cls.categorical_columns + cls.categorical_text_columns
+        }
+    if check_for_header(fname):
+        df = pd.read_csv(fname, dtype=dtype)
+    else:
+        df = pd.read_csv(fname, names = cls.raw_data_column_map.keys(), dtype=dtype)
+    for c, pattern in cls.filename_columns.items():
+        df[c] = int(re.search(pattern, fname).group(1))
+    return df
+
+# Bytes taken by a reading with an empty value, e.g. `"2014-02-13 00:20:00": "", `
+WEATHER_READING_MIN_BYTES = 24
+
+def read_weather_json_raw_data(cls, fname):
+    """
+    Reads a file of JSON objects, one per line, mapping timestamps to readings
+    of the variable the file is named after, straight into arrays
+    """
+    if not fname.endswith('.txt'):
+        raise ValueError(f"{fname} is not a `.txt` file")
+    variable = os.path.split(fname)[-1].split('.')[0]
+    if os.path.getsize(fname) == 0:
+        return pd.DataFrame({'timestamp': [], variable: []})
+    with open(fname, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm) // WEATHER_READING_MIN_BYTES + 1
+        timestamps = np.empty(size, dtype=object)
+        values = np.empty(size, dtype=np.float64)
+        n = 0
+        for line in iter(mm.readline, b''):
+            if not line.strip():
+                continue
+            readings = json_loads(line)
+            if n + len(readings) > size:
+                size = 2 * (n + len(readings))
+                timestamps, values = np.resize(timestamps, size), np.resize(values, size)
+            timestamps[n:n + len(readings)] = list(readings.keys())
+            values[n:n + len(readings)] = [
+                np.nan if v is None or v == '' else float(v) for v in readings.values()
+                ]
+            n += len(readings)
+    return pd.DataFrame({'timestamp': timestamps[:n], variable: values[:n]})
+
+raw_data_readers = {
+    'csv': read_csv_raw_data,
+    'weather_json': read_weather_json_raw_data,
+}
 
-    # Column definitions
-    id = Column(Integer, primary_key=True)
-    ozone = Column(Float)
-    particullate_matter = Column(Float)
-    carbon_monoxide = Column(Float)
-    sulfure_dioxide = Column(Float)
-    nitrogen_dioxide = Column(Float)
-    longitude = Column(Float)
-    latitude = Column(Float)
-    timestamp = Column(DateTime)
-    report_id = Column(Integer, ForeignKey('traffic_sensors.id'))
-    dataset_id = Column(Integer, ForeignKey('datasets.id'))
 
-    # Uniqueness constraints
-    __table_args__ = (
-        UniqueConstraint(
-            'longitude',
-            'latitude',
-            'timestamp',
-            'report_id',
-            name='_space_time_uc'
-            ),
-    )
+class DataTypeModel:
+    """Shared extract and transform steps of the data type models"""
 
-    raw_data_column_map = {
-        'ozone': 'ozone',
-        'particullate_matter': 'particullate_matter',
-        'carbon_monoxide': 'carbon_monoxide',
-        'sulfure_dioxide': 'sulfure_dioxide',
-        'nitrogen_dioxide': 'nitrogen_dioxide',
-        'longitude': 'longitude',
-        'latitude': 'latitude',
-        'timestamp': 'timestamp',
-    }
+    raw_data_column_map = {}
+    reader = 'csv'
+    datetime_columns = []
+    categorical_columns = []  # stored as ids into `category_values`
+    categorical_text_columns = []  # handled as categories, but stored as text
+    offloaded_columns = []
+    spatial_columns = []
+    filename_columns = {}  # column: regex of the file name capturing its value
+    column_types = {}  # column: type in the spec, e.g. float
+    column_rules = {}  # column: `required` / `min` / `max` rules checked on load
+    drop_duplicates = False
+    partial_columns = False  # files only hold the timestamp and one other column
 
     @classmethod
     def read_raw_data(cls, fname, dataset):
-        assert fname.endswith('.csv')
-        if check_for_header(fname):
-            df = pd.read_csv(fname)
-        else:
-            df = pd.read_csv(fname, names = cls.raw_data_column_map.keys())
-        df['report_id'] = int(fname.split('Data')[-1][:-4])
-        return df
+        return raw_data_readers[cls.reader](cls, fname)
 
     @classmethod
     def validate_raw_data(cls, df):
         missing_cols = set(cls.raw_data_column_map.keys()).difference(set(df.columns))
-        if missing_cols:
+        if cls.partial_columns:
+            if 'timestamp' in missing_cols or \
+                    len(missing_cols) != (len(cls.raw_data_column_map) - 2):
+                msg = f"Raw data should have a timestamp and one other column: {list(df.columns)}"
+                log.error(msg)
+                raise ValueError(msg)
+        elif missing_cols:
             msg = f"Raw data missing columns: {missing_cols}"
             log.error(msg)
             raise ValueError(msg)
 
     @classmethod
     def transform_raw_data(cls, df, dataset):
+        if cls.drop_duplicates:
+            df = df.drop_duplicates().reset_index(drop=True)
         df['dataset_id'] = dataset.id
         df = df.rename(columns=cls.raw_data_column_map)
-        df['timestamp']= pd.to_datetime(df['timestamp'])
-        return df[[c.name for c in cls.__table__.c if c.name != 'id']]
-
-
-class WeatherData(Base):
-    """Weather Data"""
-
-    __tablename__ = 'weather_data'
-
-    # Column definitions
-    id = Column(Integer, primary_key=True)
-    timestamp = Column(DateTime)
-    dew_point = Column(Float)
-    pressure = Column(Float)
-    wind_direction = Column(Float)
-    temperature = Column(Float)
-    visibility = Column(Float)
-    wind_speed = Column(Float)
-    humidity = Column(Float)
-    dataset_id = Column(Integer, ForeignKey('datasets.id'))
-
-
-    # Uniqueness constraints
-    __table_args__ = (
-        UniqueConstraint(
-            'timestamp',
-            'dataset_id',
-            name='_weather_uc'
-            ),
-    )
-
-    raw_data_column_map = {
-        'timestamp': 'timestamp',
-        'dewptm': 'dew_point',
-        'pressurem': 'pressure',
-        'wdird': 'wind_direction',
-        'tempm': 'temperature',
-        'vism': 'visibility',
-        'wspdm': 'wind_speed',
-        'hum': 'humidity',
-    }
-
-    @classmethod
-    def read_raw_data(cls, fname, dataset):
-        assert fname.endswith('.txt'), f"{fname} is not a `.txt` file"
-        variable = os.path.split(fname)[-1].split('.')[0]
-        data = []
-        with open(fname, 'r') as f:
-            for line in f.readlines():
-                data.extend([
-                    {'timestamp': t, variable: float(v) if v else None}
-                    for t,v in json.loads(line).items()
-                    ])
-        df = pd.DataFrame.from_records(data)
-        return df
-
-    @classmethod
-    def validate_raw_data(cls, df):
-        missing_cols = set(cls.raw_data_column_map.keys()).difference(set(df.columns))
-        assert 'timestamp' not in missing_cols
-        # we only get 2 columns at a time from this data
-        assert len(missing_cols) == (len(cls.raw_data_column_map) - 2)
-
-    @classmethod
-    def transform_raw_data(cls, df, dataset):
-        df['dataset_id'] = dataset.id
-        df = df.rename(columns=cls.raw_data_column_map)
-        df['timestamp']= pd.to_datetime(df['timestamp'])
-        return df[[c.name for c in cls.__table__.c if c.name != 'id' and c.name in df.columns]]
-
-
-class ParkingData(Base):
-    """Parking Data"""
-
-    __tablename__ = 'parking_data'
-
-    # Column definitions
-    id = Column(Integer, primary_key=True)
-    vehicle_count = Column(Integer)
-    timestamp = Column(DateTime)
-    _id = Column(Integer)
-    total_spaces = Column(Integer)
-    garage_code = Column(String, ForeignKey('parking_lots.garage_code'))
-    stream_time = Column(DateTime)
-    dataset_id = Column(Integer, ForeignKey('datasets.id'))
-
-    # Uniqueness constraints
-    __table_args__ = (
-        UniqueConstraint(
-            'garage_code',
-            'timestamp',
-            name='_space_time_uc'
-            ),
-    )
-
-    raw_data_column_map = {
-        'vehiclecount': 'vehicle_count',
-        'updatetime': 'timestamp',
-        '_id': '_id',
-        'totalspaces': 'total_spaces',
-        'garagecode': 'garage_code',
-        'streamtime': 'stream_time',
+        for c in cls.datetime_columns:
+            if c in df.columns:
+                df[c] = pd.to_datetime(df[c])
+        for c in cls.categorical_columns + cls.categorical_text_columns:
+            df[c] = df[c].astype('category')
+        if 'geohash' in cls.__table__.c and cls.spatial_columns:
+            lat, lon = cls.spatial_columns[0]
+            df['geohash'] = encode_geohash(df[lat], df[lon])
+        columns = transformed_columns(cls)
+        if cls.partial_columns:
+            columns = [c for c in columns if c in df.columns]
+        return df[columns]
+
+
+def make_data_type_model(spec):
+    """Builds a data type model from its spec in `data_types.json`"""
+    attrs = {
+        '__doc__': spec['name'],
+        '__tablename__': spec['table'],
+        'id': Column(Integer, primary_key=True),
+        'raw_data_column_map': spec['raw_data_column_map'],
+        'reader': spec.get('reader', DataTypeModel.reader),
+        'datetime_columns': [],
+        'categorical_columns': [],
+        'categorical_text_columns': [],
+        'offloaded_columns': [],
+        'spatial_columns': [tuple(p) for p in spec.get('spatial_columns', [])],
+        'filename_columns': spec.get('filename_columns', {}),
+        'drop_duplicates': spec.get('drop_duplicates', False),
+        'partial_columns': spec.get('partial_columns', False),
+        'column_types': {c['name']: c['type'] for c in spec['columns']},
+        'column_rules': {
+            c['name']: {k: c[k] for k in ('required', 'min', 'max') if k in c}
+            for c in spec['columns'] if any(k in c for k in ('required', 'min', 'max'))
+            },
     }
-
-    @classmethod
-    def read_raw_data(cls, fname, dataset):
-        assert fname.endswith('.csv')
-        if check_for_header(fname):
-            return pd.read_csv(fname)
+    for c in spec['columns']:
+        name = c['name']
+        if c['type'] == 'category':
+            attrs['categorical_columns'].append(name)
+            attrs[f'{name}_id'] = Column(Integer, ForeignKey('category_values.id'))
+        elif c['type'] == 'text':
+            attrs['offloaded_columns'].append(name)
+            attrs[f'{name}_digest'] = Column(String, ForeignKey('text_payloads.digest'))
+            attrs[name] = OffloadedText()
         else:
-            return pd.read_csv(fname, names = cls.raw_data_column_map.keys())
-
-    @classmethod
-    def validate_raw_data(cls, df):
-        missing_cols = set(cls.raw_data_column_map.keys()).difference(set(df.columns))
-        if missing_cols:
-            msg = f"Raw data missing columns: {missing_cols}"
-            log.error(msg)
-            raise ValueError(msg)
-
-    @classmethod
-    def transform_raw_data(cls, df, dataset):
-        df['dataset_id'] = dataset.id
-        df = df.rename(columns=cls.raw_data_column_map)
-        df['timestamp']= pd.to_datetime(df['timestamp'])
-        df['stream_time']= pd.to_datetime(df['stream_time'])
-        return df[[c.name for c in cls.__table__.c if c.name != 'id']]
-
-
-class SocialEventData(Base):
-    """Social Event Data"""
-
-    __tablename__ = 'social_event_data'
+            args = [ForeignKey(c['foreign_key'])] if 'foreign_key' in c else []
+            attrs[name] = Column(_column_types[c['type']], *args, unique=c.get('unique', False))
+            if c['type'] == 'datetime':
+                attrs['datetime_columns'].append(name)
+            if c.get('categorical'):
+                attrs['categorical_text_columns'].append(name)
+    attrs['dataset_id'] = Column(Integer, ForeignKey('datasets.id'))
+    attrs['__table_args__'] = tuple(
+        UniqueConstraint(*uc['columns'], name=uc['name'])
+        for uc in spec.get('unique_constraints', [])
+        )
+    return type(spec['class_name'], (DataTypeModel, Base), attrs)
 
-    # Column definitions
-    id = Column(Integer, primary_key=True)
-    name = Column(String)  # e.g. "Planning and Regulatory Committee"
-    url = Column(String)  # e.g. http://www.surreycc.public-i.tv/core/portal/webcast_interactive/144043
-    description = Column(String)  # "Planning and Regulatory Committee 03/09/2014 10.30 am Ashcombe Suite County Hall Kingston upon Thames Surrey KT1 2DN"
-    timestamp = Column(DateTime)  # e.g. "Wed 03 Sep 2014 10:30:00 +0100"
-    dataset_id = Column(Integer, ForeignKey('datasets.id'))
 
-    # Uniqueness constraints
-    __table_args__ = (
-        UniqueConstraint(
-            'name',
-            'url',
-            name='_event_uc'
-            ),
-    )
-
-    raw_data_column_map = {
-        'name': 'name',
-        'url': 'url',
-        'description': 'description',
-        'webcast': 'webcast',
-        'timestamp': 'timestamp',
+with open(DATA_TYPE_SPECS_FILE) as f:
+    data_type_registry = {
+        spec['name']: make_data_type_model(spec) for spec in json.load(f)
     }
 
-    @classmethod
-    def read_raw_data(cls, fname, dataset):
-        assert fname.endswith('.csv')
-        if check_for_header(fname):
-            return pd.read_csv(fname)
-        else:
-            return pd.read_csv(fname, names = cls.raw_data_column_map.keys())
-
-    @classmethod
-    def validate_raw_data(cls, df):
-        missing_cols = set(cls.raw_data_column_map.keys()).difference(set(df.columns))
-        if missing_cols:
-            msg = f"Raw data missing columns: {missing_cols}"
-            log.error(msg)
-            raise ValueError(msg)
-
-    @classmethod
-    def transform_raw_data(cls, df, dataset):
-        df['dataset_id'] = dataset.id
-        df = df.rename(columns=cls.raw_data_column_map)
-        df['timestamp']= pd.to_datetime(df['timestamp'])
-        return df[[c.name for c in cls.__table__.c if c.name != 'id']]
-
-
-class CulturalEventData(Base):
-    """Cultural Event Data"""
-
-    __tablename__ = 'cultural_event_data'
-
-    # Column definitions
-    id = Column(Integer, primary_key=True)
-    category_number = Column(Integer)
-    city = Column(String)
-    name = Column(String)
-    url = Column(String)
-    price = Column(String)
-    created_time = Column(Integer)
-    post_code = Column(Integer)
-    longitude = Column(Float)
-    event_id = Column(String, unique=True)
-    xml = Column(String)
-    street = Column(String)
-    room = Column(String)
-    timestamp = Column(DateTime)
-    latitude = Column(Float)
-    calendar_url = Column(String)
-    _id = Column(Integer)
-    event_type = Column(String)
-    image_url = Column(String)
-    genre = Column(String)
-    dataset_id = Column(Integer, ForeignKey('datasets.id'))
-
-    raw_data_column_map = {
-        'category_number': 'category_number',  # e.g. 1
-        'city': 'city',  # e.g. Aarhus C
-        'name': 'name',  # e.g. KAMMERKONCERT
-        'url': 'url',  # e.g. http://www.billetlugen.dk/referer/?r=266abe1b7fab4562a5c2531d0ae62171&p=/koeb/billetter/29048/46773/
-        'price': 'price',  # e.g. 85.00 - 115.00 DKK
-        'created_time': 'created_time',  # e.g. 1403593223
-        'post_code': 'post_code',  # e.g. 8000
-        'longitude': 'longitude',  # e.g. 10.19887
-        'event_id': 'event_id',  # e.g. 46773
-        'xml': 'xml',  # e.g. `<p><!--[if gte mso 9]>...`
-        'street': 'street',  # e.g. Thomas Jensens AllÃ©
-        'room': 'room',  # e.g. Symfonisk Sal
-        'timestamp': 'timestamp',  # e.g. 2014-09-21T15:00:00
-        'latitude': 'latitude',  # e.g. 56.1519158
-        'calendar_url': 'calendar_url',  # e.g. http://www.musikhusetaarhus.dk/kalender/29048/
-        '_id': '_id',  # e.g. 901
-        'event_type': 'event_type',  # e.g. Musik
-        'image_url': 'image_url',  # e.g. http://static.billetlugen.dk/images/events/b/29048.jpg
-        'genre': 'genre',  # e.g. Klassisk
+RoadTrafficData = data_type_registry['Road Traffic Data']
+PollutionData = data_type_registry['Pollution Data']
+WeatherData = data_type_registry['Weather Data']
+ParkingData = data_type_registry['Parking Data']
+SocialEventData = data_type_registry['Social Event Data']
+CulturalEventData = data_type_registry['Cultural Event Data']
+LibraryEventData = data_type_registry['Library Event Data']
+
+# Rollup Models
+
+def make_rollup_model(class_name, data_type_cls, bucket, entity_column, value_columns):
+    """Builds a model holding per-entity, per-bucket aggregates of a data type"""
+    tablename = f"{data_type_cls.__tablename__}_{bucket}"
+    attrs = {
+        '__doc__': f"{data_type_cls.__doc__} ({bucket.capitalize()} Rollup)",
+        '__tablename__': tablename,
+        'id': Column(Integer, primary_key=True),
+        entity_column: Column(data_type_cls.__table__.c[entity_column].type),
+        'bucket_start': Column(DateTime),
+        'row_count': Column(Integer),
+        '__table_args__': (
+            UniqueConstraint(
+                entity_column,
+                'bucket_start',
+                name=f'_{tablename}_uc'
+                ),
+        ),
+        'source_cls': data_type_cls,
+        'bucket_freq': {'hourly': 'h', 'daily': 'D'}[bucket],
+        'entity_column': entity_column,
+        'value_columns': value_columns,
     }
+    for c in value_columns:
+        attrs[f'{c}_count'] = Column(Integer)
+        attrs[f'{c}_mean'] = Column(Float)
+        attrs[f'{c}_min'] = Column(Float)
+        attrs[f'{c}_max'] = Column(Float)
+    return type(class_name, (Base,), attrs)
+
+
+_road_traffic_rollup_columns = ['avg_measured_time', 'avg_speed', 'median_measured_time', 'vehicle_count']
+_parking_rollup_columns = ['vehicle_count', 'total_spaces']
+_pollution_rollup_columns = ['ozone', 'particullate_matter', 'carbon_monoxide', 'sulfure_dioxide', 'nitrogen_dioxide']
+
+RoadTrafficHourlyRollup = make_rollup_model(
+    'RoadTrafficHourlyRollup', RoadTrafficData, 'hourly', 'report_id', _road_traffic_rollup_columns)
+RoadTrafficDailyRollup = make_rollup_model(
+    'RoadTrafficDailyRollup', RoadTrafficData, 'daily', 'report_id', _road_traffic_rollup_columns)
+ParkingHourlyRollup = make_rollup_model(
+    'ParkingHourlyRollup', ParkingData, 'hourly', 'garage_code', _parking_rollup_columns)
+ParkingDailyRollup = make_rollup_model(
+    'ParkingDailyRollup', ParkingData, 'daily', 'garage_code', _parking_rollup_columns)
+PollutionHourlyRollup = make_rollup_model(
+    'PollutionHourlyRollup', PollutionData, 'hourly', 'report_id', _pollution_rollup_columns)
+PollutionDailyRollup = make_rollup_model(
+    'PollutionDailyRollup', PollutionData, 'daily', 'report_id', _pollution_rollup_columns)
+
+rollup_registry = {
+    'Road Traffic Data Hourly': RoadTrafficHourlyRollup,
+    'Road Traffic Data Daily': RoadTrafficDailyRollup,
+    'Parking Data Hourly': ParkingHourlyRollup,
+    'Parking Data Daily': ParkingDailyRollup,
+    'Pollution Data Hourly': PollutionHourlyRollup,
+    'Pollution Data Daily': PollutionDailyRollup,
+}
 
-    @classmethod
-    def read_raw_data(cls, fname, dataset):
-        assert fname.endswith('.csv')
-        if check_for_header(fname):
-            return pd.read_csv(fname)
-        else:
-            return pd.read_csv(fname, names = cls.raw_data_column_map.keys())
-
-    @classmethod
-    def validate_raw_data(cls, df):
-        missing_cols = set(cls.raw_data_column_map.keys()).difference(set(df.columns))
-        if missing_cols:
-            msg = f"Raw data missing columns: {missing_cols}"
-            log.error(msg)
-            raise ValueError(msg)
-
-    @classmethod
-    def transform_raw_data(cls, df, dataset):
-        df['dataset_id'] = dataset.id
-        df = df.rename(columns=cls.raw_data_column_map)
-        df['timestamp']= pd.to_datetime(df['timestamp'])
-        return df[[c.name for c in cls.__table__.c if c.name != 'id']]
-
+# Derived Data Models
 
-class LibraryEventData(Base):
-    """Library Event Data"""
+class TrafficPollutionData(Base):
+    """Road traffic readings aligned with the nearest pollution reading of the same sensor"""
 
-    __tablename__ = 'library_event_data'
+    __tablename__ = 'traffic_pollution_data'
 
     # Column definitions
     id = Column(Integer, primary_key=True)
-    lid = Column(String)
-    city = Column(String)
-    end_time = Column(DateTime)
-    title = Column(String)
-    url = Column(String)
-    price = Column(String)
-    changed = Column(DateTime)
-    content = Column(String)
-    zip_code = Column(Integer)
-    library = Column(String)
-    image_url = Column(String)
-    teaser = Column(String)
-    street = Column(String)
-    status = Column(Integer)
-    longitude = Column(Float)
-    start_time = Column(DateTime)
-    latitude = Column(Float)
-    _id = Column(Integer)
-    event_id = Column(Integer)
-    stream_time = Column(DateTime)
-    dataset_id = Column(Integer, ForeignKey('datasets.id'))
-
-    # Uniqueness constraints
-    __table_args__ = (
-        UniqueConstraint(
-            'title',
-            'url',
-            name='_event_uc'
-            ),
-    )
-
-    raw_data_column_map = {
-        'lid': 'lid',
-        'city': 'city',
-        'endtime': 'end_time',
-        'title': 'title',
-        'url': 'url',
-        'price': 'price',
-        'changed': 'changed',
-        'content': 'content',
-        'zipcode': 'zip_code',
-        'library': 'library',
-        'imageurl': 'image_url',
-        'teaser': 'teaser',
-        'street': 'street',
-        'status': 'status',
-        'longitude': 'longitude',
-        'starttime': 'start_time',
-        'latitude': 'latitude',
-        '_id': '_id',
-        'id': 'event_id',
-        'streamtime': 'stream_time',
-    }
+    traffic_id = Column(Integer, ForeignKey('road_traffic_data.id'), unique=True)
+    pollution_id = Column(Integer, ForeignKey('pollution_data.id'))
+    report_id = Column(Integer, ForeignKey('traffic_sensors.id'))
+    timestamp = Column(DateTime)
+    pollution_timestamp = Column(DateTime)
+    avg_measured_time = Column(Float)
+    avg_speed = Column(Float)
+    median_measured_time = Column(Float)
+    vehicle_count = Column(Float)
+    ozone = Column(Float)
+    particullate_matter = Column(Float)
+    carbon_monoxide = Column(Float)
+    sulfure_dioxide = Column(Float)
+    nitrogen_dioxide = Column(Float)
 
-    @classmethod
-    def read_raw_data(cls, fname, dataset):
-        assert fname.endswith('.csv')
-        if check_for_header(fname):
-            return pd.read_csv(fname)
-        else:
-            return pd.read_csv(fname, names = cls.raw_data_column_map.keys())
+    traffic_columns = ['avg_measured_time', 'avg_speed', 'median_measured_time', 'vehicle_count']
+    pollution_columns = ['ozone', 'particullate_matter', 'carbon_monoxide', 'sulfure_dioxide', 'nitrogen_dioxide']
 
-    @classmethod
-    def validate_raw_data(cls, df):
-        missing_cols = set(cls.raw_data_column_map.keys()).difference(set(df.columns))
-        if missing_cols:
-            msg = f"Raw data missing columns: {missing_cols}"
-            log.error(msg)
-            raise ValueError(msg)
 
-    @classmethod
-    def transform_raw_data(cls, df, dataset):
-        df['dataset_id'] = dataset.id
-        df = df.rename(columns=cls.raw_data_column_map)
-        df['end_time'] = pd.to_datetime(df['end_time'])
-        df['changed'] = pd.to_datetime(df['changed'])
-        df['start_time'] = pd.to_datetime(df['start_time'])
-        df['stream_time'] = pd.to_datetime(df['stream_time'])
-        return df[[c.name for c in cls.__table__.c if c.name != 'id']]
-
-
-data_type_registry = {
-    'Road Traffic Data': RoadTrafficData,
-    'Pollution Data': PollutionData,
-    'Weather Data': WeatherData,
-    'Parking Data': ParkingData,
-    'Social Event Data': SocialEventData,
-    'Cultural Event Data': CulturalEventData,
-    'Library Event Data': LibraryEventData,
+derived_registry = {
+    'Traffic Pollution Data': TrafficPollutionData,
 }
 
 # Meta Data Models
@@ -535,6 +385,10 @@ class TrafficSensor(Base):
     extid = Column(Integer)
     road_type = Column(String)
     point_1_longitude = Column(Float)
+    point_1_geohash = Column(String)
+    point_2_geohash = Column(String)
+    point_1_address = Column(String)  # reverse geocoded, see `geocoding.py`
+    point_2_address = Column(String)
     report_id = Column(Integer)
     report_name = Column(String)
     point_1_country = Column(String)
@@ -571,10 +425,17 @@ class TrafficSensor(Base):
         '_id': 'source_id',
     }
 
+    spatial_columns = [
+        ('point_1_latitude', 'point_1_longitude'),
+        ('point_2_latitude', 'point_2_longitude'),
+    ]
+
     @classmethod
-    def fromdict(cls, d):
-        renamed_d = dict([(cls.raw_data_column_map[k], v) for k,v in d.items()])
-        return cls(**renamed_d)
+    def transform_raw_data(cls, df):
+        df = df.rename(columns=cls.raw_data_column_map)
+        for p in ('point_1', 'point_2'):
+            df[f'{p}_geohash'] = encode_geohash(df[f'{p}_latitude'], df[f'{p}_longitude'])
+        return df
 
 class ParkingLot(Base):
 
@@ -588,13 +449,25 @@ class ParkingLot(Base):
     house_number = Column(String)
     latitude = Column(Float)
     longitude = Column(Float)
+    geohash = Column(String)
+
+    raw_data_column_map = {
+        'garagecode': 'garage_code',
+        'city': 'city',
+        'postalcode': 'postal_code',
+        'street': 'street',
+        'housenumber': 'house_number',
+        'latitude': 'latitude',
+        'longitude': 'longitude',
+    }
+
+    spatial_columns = [('latitude', 'longitude')]
 
     @classmethod
-    def fromdict(cls, d):
-        d['garage_code'] = d.pop('garagecode')
-        d['postal_code'] = d.pop('postalcode')
-        d['house_number'] = d.pop('housenumber')
-        return cls(**d)
+    def transform_raw_data(cls, df):
+        df = df.rename(columns=cls.raw_data_column_map)
+        df['geohash'] = encode_geohash(df['latitude'], df['longitude'])
+        return df
 
 metadata_registry = {
     'Traffic Sensor': TrafficSensor,
@@ -620,7 +493,6 @@ class DataType(Base):
             instance = cls(name=name)
             session.add(instance)
             session.flush()
-            session.commit()
             return instance
 
 
@@ -641,7 +513,6 @@ class Location(Base):
             instance = cls(name=name)
             session.add(instance)
             session.flush()
-            session.commit()
             return instance
 
 
@@ -653,7 +524,7 @@ class Dataset(Base):
     # Column definitions
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True)
-    url = Column(String, unique=True)
+    url = Column(String)  # not unique, as CityPulse lists some files under several datasets
     data_type_id = Column(Integer, ForeignKey('data_types.id'))
     location_id = Column(Integer, ForeignKey('locations.id'))
 
@@ -685,21 +556,258 @@ class Dataset(Base):
             instance = cls.fromdict(ds_dict)
             session.add(instance)
             session.flush()
-            session.commit()
             return instance
 
 
+class CategoryValue(Base):
+    """Lookup of the distinct values of the repetitive text columns"""
+
+    __tablename__ = "category_values"
+
+    # Column definitions
+    id = Column(Integer, primary_key=True)
+    category = Column(String)  # e.g. road_traffic_data.status
+    value = Column(String)
+
+    # Uniqueness constraints
+    __table_args__ = (
+        UniqueConstraint(
+            'category',
+            'value',
+            name='_category_value_uc'
+            ),
+    )
+
+    @classmethod
+    def _get_ids(cls, category, values, session):
+        return dict(
+            session.query(cls.value, cls.id)
+            .filter(cls.category == category, cls.value.in_(values))
+            .all()
+            )
+
+    @classmethod
+    def encode(cls, values, category, session):
+        """Maps a series of values to their ids, adding any values not seen before"""
+        values = values.astype('category')
+        categories = [str(v) for v in values.cat.categories]
+        ids = cls._get_ids(category, categories, session)
+        new_values = [v for v in categories if v not in ids]
+        if new_values:
+            session.execute(
+                cls.__table__.insert(),
+                [dict(category=category, value=v) for v in new_values],
+                )
+            ids = cls._get_ids(category, categories, session)
+        # The trailing None is looked up by the -1 code of missing values
+        lookup = np.array([ids[v] for v in categories] + [None], dtype=object)
+        return pd.Series(lookup[values.cat.codes.to_numpy()], index=values.index)
+
+
+class TextPayload(Base):
+    """Compressed large text values, stored once per distinct value"""
+
+    __tablename__ = "text_payloads"
+
+    # Column definitions
+    digest = Column(String, primary_key=True)  # blake2b hex digest of the text
+    data = Column(LargeBinary)  # zlib compressed utf-8 text
+
+    @staticmethod
+    def digest_text(value):
+        return hashlib.blake2b(value.encode('utf-8'), digest_size=16).hexdigest()
+
+    @classmethod
+    def store(cls, values, session):
+        """Compresses and stores a series of text, returning the digest of each value"""
+        distinct = values.dropna().astype(str).unique()
+        digests = {v: cls.digest_text(v) for v in distinct}
+        if digests:
+            stmt = sqlite_insert(cls.__table__).on_conflict_do_nothing(index_elements=['digest'])
+            session.execute(stmt, [
+                dict(digest=d, data=zlib.compress(v.encode('utf-8')))
+                for v, d in digests.items()
+                ])
+        return values.map(digests, na_action='ignore').astype(object).where(values.notna(), None)
+
+    @classmethod
+    def load(cls, digest, session):
+        data = session.query(cls.data).filter(cls.digest == digest).scalar()
+        return None if data is None else zlib.decompress(data).decode('utf-8')
+
+
+@event.listens_for(_OrmSession, 'before_flush')
+def _store_pending_payloads(session, flush_context, instances):
+    # Stores the text set through `OffloadedText` on new or changed instances
+    for instance in list(session.new) + list(session.dirty):
+        pending = instance.__dict__.pop('_pending_payloads', None)
+        if pending:
+            TextPayload.store(pd.Series(list(pending.values()), dtype=object), session)
+
+
+class QuarantinedRow(Base):
+    """A raw data row which failed validation, kept aside rather than loaded"""
+
+    __tablename__ = "quarantined_rows"
+
+    # Column definitions
+    id = Column(Integer, primary_key=True)
+    dataset_id = Column(Integer, ForeignKey('datasets.id'))
+    data_type = Column(String)  # table the row was bound for, e.g. road_traffic_data
+    file_name = Column(String)
+    row_number = Column(Integer)  # position of the row in the raw data, from 0
+    reasons = Column(String)  # e.g. "avg_speed: not a number; timestamp: required"
+    data = Column(String)  # json of the raw row
+    quarantined_at = Column(DateTime)
+
+
+class FileFingerprint(Base):
+    """Digest of a loaded dataset file's table, name and content, to skip identical files"""
+
+    __tablename__ = "file_fingerprints"
+
+    # Column definitions
+    digest = Column(String, primary_key=True)  # see `dedupe.dataset_file_digest`
+    dataset_id = Column(Integer, ForeignKey('datasets.id'))
+    file_name = Column(String)
+    loaded_at = Column(DateTime)
+
+
+class RowFingerprint(Base):
+    """Hash of a loaded row's values, to skip rows already loaded from other files"""
+
+    __tablename__ = "row_fingerprints"
+
+    # Column definitions
+    fingerprint = Column(Integer, primary_key=True)  # 64 bit hash of the row and its table
+
+
+class IngestionRun(Base):
+    """A single `run-pipeline` invocation"""
+
+    __tablename__ = "ingestion_runs"
+
+    # Column definitions
+    id = Column(Integer, primary_key=True)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    status = Column(String)  # `running`, then `ok` or `failed`
+
+    @classmethod
+    def start(cls, session):
+        # Runs left running were killed before they could finish (as runs
+        # don't overlap), so they're closed out as failed
+        stale = session.query(cls).filter(cls.finished_at.is_(None)).all()
+        for run in stale:
+            log.warning(f"Closing out ingestion run {run.id}, which never finished")
+            run.finish(session, status='failed')
+        instance = cls(started_at=datetime.now(), status='running')
+        session.add(instance)
+        session.commit()
+        return instance
+
+    def finish(self, session, status='ok'):
+        self.finished_at = datetime.now()
+        self.status = status
+        session.commit()
+
+
+class ChangeLogEntry(Base):
+    """A range of rows inserted into a data type table by a run, from one file"""
+
+    __tablename__ = "change_log"
+
+    # Column definitions
+    id = Column(Integer, primary_key=True)
+    run_id = Column(Integer, ForeignKey('ingestion_runs.id'), index=True)
+    table_name = Column(String)  # e.g. road_traffic_data
+    dataset_id = Column(Integer, ForeignKey('datasets.id'))
+    file_name = Column(String)
+    min_id = Column(Integer)
+    max_id = Column(Integer)
+    row_count = Column(Integer)
+    logged_at = Column(DateTime)
+
+
 reference_registry = {
     'Data Type': DataType,
     'Location': Location,
     'Dataset': Dataset,
+    'Category Value': CategoryValue,
+    'Text Payload': TextPayload,
+    'Quarantined Row': QuarantinedRow,
+    'File Fingerprint': FileFingerprint,
+    'Row Fingerprint': RowFingerprint,
+    'Ingestion Run': IngestionRun,
+    'Change Log Entry': ChangeLogEntry,
 }
 
+# Decoded Views
+
+_view_metadata = MetaData()
+
+def decoded_view(cls):
+    """
+    The view of a model's table with its category ids swapped for their values.
+    Offloaded text is left as its digest, as decompressing it takes a Python
+    function which plain SQLite connections (e.g. the `sqlite3` shell) lack.
+    """
+    name = f"{cls.__tablename__}_view"
+    if name not in _view_metadata.tables:
+        stored = encoded_columns(cls)
+        Table(name, _view_metadata, *[
+            Column(stored[c.name], String) if c.name in stored else Column(c.name, c.type)
+            for c in cls.__table__.c
+            ])
+    return _view_metadata.tables[name]
+
+def decoded_select(cls, source=None, inflate_text=True):
+    """
+    Selects the rows of a model's table (or of `source`, with the same columns)
+    with its category ids decoded, as in `decoded_view`, and its payload
+    digests swapped for their text unless `inflate_text` is false. The text is
+    decompressed by the `inflate` function registered on the package's
+    connections.
+    """
+    source = cls.__table__.alias('t') if source is None else source
+    encoded, offloaded = encoded_columns(cls), offloaded_digest_columns(cls)
+    columns, joined = [], source
+    for c in cls.__table__.c:
+        if c.name in encoded:
+            cv = CategoryValue.__table__.alias(f"cv_{encoded[c.name]}")
+            joined = joined.outerjoin(cv, cv.c.id == source.c[c.name])
+            columns.append(cv.c.value.label(encoded[c.name]))
+        elif c.name in offloaded and inflate_text:
+            tp = TextPayload.__table__.alias(f"tp_{offloaded[c.name]}")
+            joined = joined.outerjoin(tp, tp.c.digest == source.c[c.name])
+            columns.append(func.inflate(tp.c.data).label(offloaded[c.name]))
+        else:
+            columns.append(source.c[c.name])
+    return select(*columns).select_from(joined)
+
+def create_decoded_view(cls, db_engine):
+    query = decoded_select(cls, inflate_text=False).compile(db_engine, compile_kwargs={'literal_binds': True})
+    with db_engine.begin() as conn:
+        conn.execute(text(f"CREATE VIEW IF NOT EXISTS {decoded_view(cls).name} AS {query}"))
+
 
 def create_tables():
+    db_engine = get_engine()
     for t in metadata_registry.values():
         t.__table__.create(bind=db_engine, checkfirst=True)
     for t in reference_registry.values():
         t.__table__.create(bind=db_engine, checkfirst=True)
+    partitioned = partitioned_table_names()
     for t in data_type_registry.values():
+        if t.__tablename__ in partitioned:
+            with db_engine.begin() as conn:
+                create_partitioned_table(t, conn)
+        else:
+            t.__table__.create(bind=db_engine, checkfirst=True)
+    for t in rollup_registry.values():
         t.__table__.create(bind=db_engine, checkfirst=True)
+    for t in derived_registry.values():
+        t.__table__.create(bind=db_engine, checkfirst=True)
+    for t in data_type_registry.values():
+        if encoded_columns(t) or offloaded_digest_columns(t):
+            create_decoded_view(t, db_engine)
@@ -0,0 +1,148 @@
+"""
+Optional monthly partitioning of the data type tables.
+
+Tables named in `PARTITIONED_TABLES` are stored as one table per month of
+`timestamp` (e.g. `road_traffic_data_p201408`), plus a `_default` partition for
+rows without a timestamp, behind a `UNION ALL` view with the table's own name.
+"""
+
+import os
+import re
+import pandas as pd
+
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Column, MetaData, Table, UniqueConstraint, select, text, union_all
+
+from .database import Session
+from .utils import load_env
+
+import logging
+log = logging.getLogger(__name__)
+
+_partition_metadata = MetaData()
+
+def partitioned_table_names() -> List[str]:
+    load_env()
+    return [t.strip() for t in os.getenv('PARTITIONED_TABLES', '').split(',') if t.strip()]
+
+def partition_name(data_type_cls, month: Optional[pd.Timestamp]) -> str:
+    if month is None:
+        return f"{data_type_cls.__tablename__}_default"
+    return f"{data_type_cls.__tablename__}_p{month:%Y%m}"
+
+def partition_table(data_type_cls, name: str) -> Table:
+    """A table with the columns and unique constraints of a data type's table"""
+    if name not in _partition_metadata.tables:
+        table = data_type_cls.__table__
+        Table(
+            name,
+            _partition_metadata,
+            *[Column(c.name, c.type, primary_key=c.primary_key, unique=c.unique) for c in table.c],
+            *[
+                UniqueConstraint(*[c.name for c in uc.columns], name=uc.name)
+                for uc in table.constraints if isinstance(uc, UniqueConstraint)
+                ],
+            )
+    return _partition_metadata.tables[name]
+
+def list_partitions(data_type_cls, session: Session) -> Dict[str, Optional[pd.Timestamp]]:
+    """Maps the partitions of a data type's table to the month they hold"""
+    pattern = re.compile(rf"^{data_type_cls.__tablename__}_(default|p(\d{{6}}))$")
+    partitions = {}
+    for name, in session.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")):
+        match = pattern.match(name)
+        if match:
+            partitions[name] = pd.Timestamp(f"{match.group(2)}01") if match.group(2) else None
+    return partitions
+
+def is_partitioned(data_type_cls, session: Session) -> bool:
+    return session.execute(
+        text("SELECT type FROM sqlite_master WHERE name = :name"),
+        dict(name=data_type_cls.__tablename__),
+        ).scalar() == 'view'
+
+def _refresh_view(data_type_cls, partitions: List[str], connection):
+    columns = ', '.join(c.name for c in data_type_cls.__table__.c)
+    name = data_type_cls.__tablename__
+    connection.execute(text(f"DROP VIEW IF EXISTS {name}"))
+    connection.execute(text(f"CREATE VIEW {name} AS " + " UNION ALL ".join(
+        f"SELECT {columns} FROM {p}" for p in sorted(partitions)
+        )))
+
+def _unique_column_sets(table: Table) -> List[List[str]]:
+    return [
+        *[[c.name for c in uc.columns] for uc in table.constraints if isinstance(uc, UniqueConstraint)],
+        *[[c.name] for c in table.c if c.unique],
+        ]
+
+def create_partitioned_table(data_type_cls, connection):
+    """Creates the view and default partition of a data type's table"""
+    if data_type_cls.partial_columns or data_type_cls.spatial_columns:
+        raise ValueError(f"{data_type_cls.__tablename__} can't be partitioned")
+    # Each partition enforces its own unique constraints, which only hold for
+    # the whole table if rows that clash always fall in the same month
+    if any('timestamp' not in columns for columns in _unique_column_sets(data_type_cls.__table__)):
+        raise ValueError(
+            f"{data_type_cls.__tablename__} can't be partitioned, its unique constraints don't include timestamp")
+    default = partition_name(data_type_cls, None)
+    partition_table(data_type_cls, default).create(bind=connection, checkfirst=True)
+    _refresh_view(data_type_cls, [default], connection)
+
+def _next_id(partitions: List[str], session: Session) -> int:
+    # Ids are kept unique across partitions, as rows are referred to by id
+    max_ids = " UNION ALL ".join(f"SELECT max(id) AS id FROM {p}" for p in partitions)
+    return (session.execute(text(f"SELECT max(id) FROM ({max_ids})")).scalar() or 0) + 1
+
+def insert_partitioned_rows(df: pd.DataFrame, data_type_cls, session: Session) -> Tuple[int, int]:
+    """
+    Routes rows to the partitions of their month, creating any new partitions,
+    and returns the first and last ids given to them
+    """
+    partitions = list_partitions(data_type_cls, session)
+    if df['timestamp'].dt.tz is not None:
+        # Stored as their local time (as in an unpartitioned table), so they're
+        # routed by it too, for `pruned_source` to find them
+        df = df.assign(timestamp=df['timestamp'].dt.tz_localize(None))
+    months = df['timestamp'].dt.to_period('M').dt.to_timestamp()
+    new_partitions = [
+        partition_name(data_type_cls, m) for m in months.dropna().unique()
+        if partition_name(data_type_cls, m) not in partitions
+        ]
+    if new_partitions:
+        log.debug(f"Creating partitions: {new_partitions}")
+        connection = session.connection()
+        for name in new_partitions:
+            partition_table(data_type_cls, name).create(bind=connection)
+        _refresh_view(data_type_cls, list(partitions) + new_partitions, connection)
+    next_id = _next_id(list(partitions), session)
+    df = df.assign(id=range(next_id, next_id + len(df)))
+    for month, rows in df.groupby(months, dropna=False, sort=False):
+        name = partition_name(data_type_cls, None if pd.isna(month) else month)
+        session.execute(partition_table(data_type_cls, name).insert(), rows.to_dict(orient='records'))
+    return next_id, next_id + len(df) - 1
+
+def pruned_source(data_type_cls, session: Session, start: datetime = None, end: datetime = None):
+    """
+    The table to select a data type's rows from `start` (inclusive) to `end`
+    (exclusive), which for a partitioned table is the union of only the
+    partitions overlapping that range
+    """
+    if not is_partitioned(data_type_cls, session):
+        return data_type_cls.__table__
+    if start is None and end is None:
+        return partition_table(data_type_cls, data_type_cls.__tablename__)
+    selected = [
+        name for name, month in list_partitions(data_type_cls, session).items()
+        if month is not None
+        and (end is None or month < pd.Timestamp(end))
+        and (start is None or month + pd.offsets.MonthBegin(1) > pd.Timestamp(start))
+        ]
+    if not selected:
+        selected = [partition_name(data_type_cls, None)]
+    if len(selected) == 1:
+        return partition_table(data_type_cls, selected[0]).alias(data_type_cls.__tablename__)
+    return union_all(
+        *[select(partition_table(data_type_cls, name)) for name in sorted(selected)]
+        ).subquery(data_type_cls.__tablename__)
@@ -1,33 +1,46 @@
 """Functions for extracting data from raw sources"""
 
 import os
-import requests
 import tarfile
 import zipfile
 import pandas as pd
 
-from sqlalchemy.exc import IntegrityError
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple, Union
 
+from sqlalchemy import func, select
+from sqlalchemy.exc import DataError, IntegrityError
+
+from .changes import record_changes
 from .database import Session
-from .models import Dataset, DataType, Location, WeatherData
-from .utils import RAW_DATA_DIR, download_file
+from .dedupe import RowFingerprints, dataset_file_digest, find_loaded_file, record_loaded_file
+from .joins import refresh_traffic_pollution
+from .models import CategoryValue, Dataset, DataType, Location, TextPayload, WeatherData
+from .partitions import insert_partitioned_rows, is_partitioned
+from .rollups import update_rollups
+from .spatial import update_spatial_index
+from .utils import download_file, raw_data_dir
+from .validation import check_rows, quarantine_rows
 
 import logging
 log = logging.getLogger(__name__)
 
+# Errors in the content of a dataset file, which fail that file alone. Anything
+# else (e.g. a KeyError from a bug or a locked database) stops the run.
+FILE_ERRORS = (ValueError, OSError, tarfile.TarError, zipfile.BadZipFile, DataError, IntegrityError)
+
 def unpack_raw_data_file(fname: str, warn_on_overwrite: bool = False):
+    data_dir = raw_data_dir()
     if fname.endswith('.tar.gz'):
-        with tarfile.open(os.path.join(RAW_DATA_DIR, fname), 'r:gz') as tar:
+        with tarfile.open(os.path.join(data_dir, fname), 'r:gz') as tar:
             for m in tar.getmembers():
-                fname = os.path.join(RAW_DATA_DIR, m.path)
+                fname = os.path.join(data_dir, m.path)
                 if os.path.exists(fname) and warn_on_overwrite:
                     log.warn(f"{fname} already exists, overwriting")
-            tar.extractall(RAW_DATA_DIR)
+            tar.extractall(data_dir)
             return [m.path for m in tar.getmembers()]
     if fname.endswith('.zip'):
-        with zipfile.ZipFile(os.path.join(RAW_DATA_DIR, fname), 'r') as zip:
-            zip.extractall(RAW_DATA_DIR)
+        with zipfile.ZipFile(os.path.join(data_dir, fname), 'r') as zip:
+            zip.extractall(data_dir)
             return [m.filename for m in zip.filelist]
     else:
         raise ValueError(f'Unknown format for: {fname}')
@@ -39,12 +52,30 @@ def iter_dataset_files(fname: str) -> str:
         data_files = [fname]
     for fname in data_files:
         if 'MACOSX' in fname: continue
-        yield os.path.join(RAW_DATA_DIR, fname)
+        fname = os.path.join(raw_data_dir(), fname)
+        if os.path.isdir(fname): continue  # directory entries of archives
+        yield fname
 
-def insert_rows_from_df(df: pd.DataFrame, data_type_cls, session: Session):
-    """Inserts rows for a `data_type` from a pandas DataFrame"""
+def insert_rows_from_df(df: pd.DataFrame, data_type_cls, session: Session) -> Optional[Tuple[int, int]]:
+    """
+    Inserts rows for a `data_type` from a pandas DataFrame, returning the first
+    and last ids of the inserted rows (if any were inserted rather than merged)
+    """
     # Doing it this way instead of creating a `data_type_cls` object for all 
     # rows to improve performance.
+    for c in getattr(data_type_cls, 'categorical_columns', []):
+        log.debug(f"Encoding {c} categories")
+        ids = CategoryValue.encode(df[c], f"{data_type_cls.__tablename__}.{c}", session)
+        df = df.assign(**{f'{c}_id': ids}).drop(columns=c)
+    for c in getattr(data_type_cls, 'offloaded_columns', []):
+        log.debug(f"Compressing {c} text")
+        digests = TextPayload.store(df[c], session)
+        df = df.assign(**{f'{c}_digest': digests}).drop(columns=c)
+    if df.empty:
+        return None
+    if is_partitioned(data_type_cls, session):
+        log.debug(f"Routing {len(df)} rows to partitions of {data_type_cls.__tablename__}")
+        return insert_partitioned_rows(df, data_type_cls, session)
     log.debug(f"Converting {len(df)} row DataFrame to list of dicts")
     all_records = df.to_dict(orient='records')
     log.debug(f"Performing insert in {data_type_cls}")
@@ -64,47 +95,136 @@ def insert_rows_from_df(df: pd.DataFrame, data_type_cls, session: Session):
                 records_for_insert.append(record)
     else:
         records_for_insert = all_records
+    if not records_for_insert:
+        return None
+    # SQLite gives new rows the next ids after the largest, and there's only one writer
+    last_id = session.execute(select(func.max(data_type_cls.__table__.c.id))).scalar() or 0
     stmt = data_type_cls.__table__.insert()
     session.execute(stmt, records_for_insert)
+    return last_id + 1, last_id + len(records_for_insert)
+
+def load_dataset_file(
+    fname: str,
+    dataset: Dataset,
+    data_type_model_cls,
+    session: Session,
+    fingerprints: RowFingerprints = None,
+    run_id: int = None,
+    ) -> Tuple[int, Optional[Tuple[int, int]]]:
+    """
+    Extracts, transforms and loads a single dataset file, returning the rows
+    written and the first and last ids of those inserted. Rows already in
+    `fingerprints` are skipped, other than for data types whose rows are merged
+    across files. The ids of the inserted rows are recorded in the change log
+    under `run_id`, if given.
+    """
+    log.info(f"Reading {fname}...")
+    raw_data = data_type_model_cls.read_raw_data(fname, dataset)
+    log.debug(f"Validating raw data...")
+    data_type_model_cls.validate_raw_data(raw_data)
+    raw_data, rejects = check_rows(raw_data, data_type_model_cls)
+    if not rejects.empty:
+        log.warning(f"Quarantining {len(rejects)} invalid row(s) of {fname}")
+        quarantine_rows(rejects, fname, dataset, data_type_model_cls, session)
+
+    log.debug(f"Transforming {len(raw_data)} rows...")
+    transformed_data = data_type_model_cls.transform_raw_data(raw_data, dataset)
+    if fingerprints is not None and not data_type_model_cls.partial_columns:
+        transformed_data = fingerprints.drop_seen(transformed_data, data_type_model_cls, session)
+
+    log.info(f"Writing to {data_type_model_cls.__tablename__}...")
+    id_range = insert_rows_from_df(transformed_data, data_type_model_cls, session)
+    if run_id is not None and id_range is not None:
+        record_changes(run_id, data_type_model_cls, dataset, fname, id_range, session)
+    update_rollups(transformed_data, data_type_model_cls, session)
+    if data_type_model_cls.spatial_columns:
+        update_spatial_index(data_type_model_cls, session)
+    return len(transformed_data), id_range
 
 def run_pipeline(
     ds_dict: Dict,
     skip_download: bool = False,
+    commit_interval: Union[str, int] = 'file',
+    fingerprints: RowFingerprints = None,
+    run_id: int = None,
     ):
-    """Runs the ETL pipeline for a single dataset"""
+    """
+    Runs the ETL pipeline for a single dataset.
+
+    Each file is loaded within a savepoint, so a file that fails with one of
+    `FILE_ERRORS` is rolled back on its own; other errors stop the run. The
+    work is committed after every file (`'file'`), once at least
+    `commit_interval` rows have been written (an `int`), or only at the end of
+    the dataset (`'dataset'`).
+
+    Files with the same name and contents as one already loaded for the data
+    type are skipped, as are rows already in `fingerprints`, which can be
+    shared across datasets.
+
+    The rows inserted are recorded in the change log under `run_id`, the
+    `IngestionRun` this is part of, if given.
+    """
+    if commit_interval not in ('file', 'dataset') and not isinstance(commit_interval, int):
+        raise ValueError(f"Unknown commit interval: {commit_interval}")
+
+    if fingerprints is None:
+        fingerprints = RowFingerprints()
 
     session = Session()
+    # Closed even if loading fails, releasing any uncommitted writes so the
+    # ingestion run can be closed out
+    try:
+        log.info("Creating the dataset record (and location if required)...")
+        data_type = DataType.get_or_create(ds_dict['data_type'], session)
+        ds_dict['data_type_id'] = data_type.id  # foriegn key of data type
+        location = Location.get_or_create(ds_dict['location'], session)
+        ds_dict['location_id'] = location.id  # foriegn key of location
+        dataset = Dataset.get_or_create(ds_dict, session)
+        data_type_model_cls = dataset.get_data_type_model_cls(session)
+        session.commit()
 
-    log.info("Creating the dataset record (and location if required)...")
-    data_type = DataType.get_or_create(ds_dict['data_type'], session)
-    ds_dict['data_type_id'] = data_type.id  # foriegn key of data type
-    location = Location.get_or_create(ds_dict['location'], session)
-    ds_dict['location_id'] = location.id  # foriegn key of location
-    dataset = Dataset.get_or_create(ds_dict, session)
-    data_type_model_cls = dataset.get_data_type_model_cls(session)
-
-    if not skip_download:
-        log.info("Downloading raw dataset files...")
-        download_file(dataset.url, dataset.raw_data_file_name)
-    else:
-        log.info("Using cached dataset files (skipping download)...")
-
-    log.info("Unpacking / listing dataset files...")
-    for fname in iter_dataset_files(dataset.raw_data_file_name):
-        log.info(f"Reading {fname}...")
-        raw_data = data_type_model_cls.read_raw_data(fname, dataset)
-        log.debug(f"Validating raw data...")
-        data_type_model_cls.validate_raw_data(raw_data)
-
-        log.debug(f"Transforming {len(raw_data)} rows...")
-        transformed_data = data_type_model_cls.transform_raw_data(raw_data, dataset)
-
-        log.info(f"Writing to {data_type_model_cls.__tablename__}...")
-        try:
-            insert_rows_from_df(transformed_data, data_type_model_cls, session)
-        except IntegrityError:
-            log.error("Uniqueness Constraint Failed, continuing without these rows...")
-            raise
-
-    session.commit()
-    session.close()
+        if not skip_download:
+            log.info("Downloading raw dataset files...")
+            download_file(dataset.url, dataset.raw_data_file_name)
+        else:
+            log.info("Using cached dataset files (skipping download)...")
+
+        log.info("Unpacking / listing dataset files...")
+        failed_files, skipped_files = [], []
+        uncommitted_rows = 0
+        inserted_id_ranges = []
+        for fname in iter_dataset_files(dataset.raw_data_file_name):
+            try:
+                digest = dataset_file_digest(fname, data_type_model_cls)
+                loaded_file = find_loaded_file(digest, session)
+                if loaded_file is not None:
+                    log.info(f"Skipping {fname}, identical to {loaded_file.file_name} (dataset {loaded_file.dataset_id})")
+                    skipped_files.append(fname)
+                    continue
+                with session.begin_nested():
+                    n_rows, id_range = load_dataset_file(
+                        fname, dataset, data_type_model_cls, session, fingerprints, run_id)
+                    record_loaded_file(digest, fname, dataset, session)
+            except FILE_ERRORS:
+                log.exception(f"Failed to load {fname}, rolled back this file")
+                failed_files.append(fname)
+                continue
+            uncommitted_rows += n_rows
+            if id_range is not None:
+                inserted_id_ranges.append(id_range)
+            if commit_interval == 'file' or \
+                    (isinstance(commit_interval, int) and uncommitted_rows >= commit_interval):
+                log.debug(f"Committing {uncommitted_rows} rows...")
+                session.commit()
+                uncommitted_rows = 0
+
+        refresh_traffic_pollution(data_type_model_cls, inserted_id_ranges, session)
+
+        session.commit()
+    finally:
+        session.close()
+
+    if skipped_files:
+        log.info(f"{len(skipped_files)} duplicate file(s) skipped for dataset: {ds_dict['name']}")
+    if failed_files:
+        log.warning(f"{len(failed_files)} file(s) failed to load for dataset: {ds_dict['name']}")
@@ -0,0 +1,159 @@
+"""Query functions for common analyst lookups, returning pandas DataFrames"""
+
+import functools
+import threading
+import time
+
+import pandas as pd
+
+from collections import OrderedDict
+from datetime import datetime
+from typing import Hashable, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from .database import Session
+from .models import (
+    Dataset,
+    IngestionRun,
+    Location,
+    ParkingData,
+    RoadTrafficData,
+    WeatherData,
+    decoded_select,
+)
+from .partitions import pruned_source
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class QueryCache:
+    """
+    Bounded LRU cache of query results. Entries expire after `ttl` seconds, and
+    all entries are dropped when an ingestion run starts or finishes.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 15 * 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._run_token = None
+        self._lock = threading.Lock()
+
+    def _check_run_token(self, run_token: Tuple):
+        if run_token != self._run_token:
+            self._entries.clear()
+            self._run_token = run_token
+
+    def get(self, key: Hashable, run_token: Tuple) -> Optional[pd.DataFrame]:
+        with self._lock:
+            self._check_run_token(run_token)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            df, created_at = entry
+            if created_at + self.ttl < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return df
+
+    def put(self, key: Hashable, run_token: Tuple, df: pd.DataFrame):
+        with self._lock:
+            self._check_run_token(run_token)
+            self._entries[key] = (df, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+cache = QueryCache()
+
+def current_run_token(session: Session) -> Tuple:
+    """Identifies the latest ingestion run and whether it has finished"""
+    return tuple(session.execute(
+        select(func.max(IngestionRun.id), func.max(IngestionRun.finished_at))
+        ).one())
+
+def cached_query(fn):
+    """
+    Caches a query function's results in `cache`. The wrapped function takes an
+    optional `session` (one is opened if not given) and `use_cache` keyword.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, session: Session = None, use_cache: bool = True, **kwargs):
+        own_session = session is None
+        if own_session:
+            session = Session()
+        try:
+            if not use_cache:
+                return fn(*args, session=session, **kwargs)
+            key = (fn.__name__, args, tuple(sorted(kwargs.items())))
+            run_token = current_run_token(session)
+            df = cache.get(key, run_token)
+            if df is None:
+                df = fn(*args, session=session, **kwargs)
+                cache.put(key, run_token, df)
+            return df.copy()
+        finally:
+            if own_session:
+                session.close()
+    return wrapper
+
+def _between(query, column, start, end):
+    if start is not None:
+        query = query.where(column >= start)
+    if end is not None:
+        query = query.where(column < end)
+    return query
+
+
+@cached_query
+def traffic_for_sensor(
+    report_id: int,
+    start: datetime = None,
+    end: datetime = None,
+    session: Session = None,
+    ) -> pd.DataFrame:
+    """Road traffic readings of a sensor from `start` (inclusive) to `end` (exclusive)"""
+    t = pruned_source(RoadTrafficData, session, start, end)
+    query = decoded_select(RoadTrafficData, t).where(t.c.report_id == report_id).order_by(t.c.timestamp)
+    query = _between(query, t.c.timestamp, start, end)
+    return pd.read_sql(query, session.connection())
+
+@cached_query
+def parking_occupancy(
+    garage_code: str,
+    start: datetime = None,
+    end: datetime = None,
+    session: Session = None,
+    ) -> pd.DataFrame:
+    """Vehicle counts of a parking lot along with the fraction of spaces occupied"""
+    p = pruned_source(ParkingData, session, start, end)
+    query = select(
+        p.c.timestamp,
+        p.c.vehicle_count,
+        p.c.total_spaces,
+        (p.c.vehicle_count * 1.0 / p.c.total_spaces).label('occupancy'),
+        ).where(p.c.garage_code == garage_code).order_by(p.c.timestamp)
+    query = _between(query, p.c.timestamp, start, end)
+    return pd.read_sql(query, session.connection())
+
+@cached_query
+def weather_at(location: str, ts: datetime, session: Session = None) -> pd.DataFrame:
+    """The latest weather reading at `location` at or before `ts`"""
+    w = WeatherData.__table__
+    query = select(w).join_from(
+        w, Dataset.__table__, w.c.dataset_id == Dataset.id,
+        ).join(
+        Location.__table__, Dataset.location_id == Location.id,
+        ).where(
+        Location.name == location,
+        w.c.timestamp <= ts,
+        ).order_by(w.c.timestamp.desc()).limit(1)
+    return pd.read_sql(query, session.connection())
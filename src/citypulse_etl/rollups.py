@@ -0,0 +1,92 @@
+"""Functions for maintaining the pre-aggregated time-bucket rollup tables"""
+
+import pandas as pd
+
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .database import Session
+from .models import rollup_registry
+
+import logging
+log = logging.getLogger(__name__)
+
+REBUILD_CHUNK_SIZE = 500_000
+
+def iter_rollup_models(data_type_cls):
+    for rollup_cls in rollup_registry.values():
+        if rollup_cls.source_cls is data_type_cls:
+            yield rollup_cls
+
+def aggregate_rows(df: pd.DataFrame, rollup_cls) -> pd.DataFrame:
+    """Computes the count / mean / min / max of each value column per entity and bucket"""
+    buckets = df['timestamp'].dt.floor(rollup_cls.bucket_freq).rename('bucket_start')
+    grouped = df.groupby([df[rollup_cls.entity_column], buckets], observed=True)
+    agg = grouped[rollup_cls.value_columns].agg(['count', 'mean', 'min', 'max'])
+    agg.columns = [f"{c}_{stat}" for c, stat in agg.columns]
+    agg['row_count'] = grouped.size()
+    agg = agg.reset_index()
+    return agg.astype(object).where(agg.notna(), None)
+
+def _merge_mean(table, excluded, c):
+    # Combines the stored and incoming means weighted by their counts
+    old_n, new_n = table.c[f'{c}_count'], excluded[f'{c}_count']
+    old_mean, new_mean = table.c[f'{c}_mean'], excluded[f'{c}_mean']
+    return case(
+        (new_n == 0, old_mean),
+        (old_n == 0, new_mean),
+        else_=(old_mean * old_n + new_mean * new_n) / (old_n + new_n),
+        )
+
+def upsert_aggregates(agg: pd.DataFrame, rollup_cls, session: Session):
+    """Merges aggregates into a rollup table, combining with any existing buckets"""
+    if agg.empty:
+        return
+    table = rollup_cls.__table__
+    stmt = sqlite_insert(table)
+    excluded = stmt.excluded
+    merged_columns = {'row_count': table.c.row_count + excluded.row_count}
+    for c in rollup_cls.value_columns:
+        merged_columns[f'{c}_count'] = table.c[f'{c}_count'] + excluded[f'{c}_count']
+        merged_columns[f'{c}_mean'] = _merge_mean(table, excluded, c)
+        merged_columns[f'{c}_min'] = func.coalesce(
+            func.min(table.c[f'{c}_min'], excluded[f'{c}_min']),
+            table.c[f'{c}_min'],
+            excluded[f'{c}_min'],
+            )
+        merged_columns[f'{c}_max'] = func.coalesce(
+            func.max(table.c[f'{c}_max'], excluded[f'{c}_max']),
+            table.c[f'{c}_max'],
+            excluded[f'{c}_max'],
+            )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[rollup_cls.entity_column, 'bucket_start'],
+        set_=merged_columns,
+        )
+    session.execute(stmt, agg.to_dict(orient='records'))
+
+def update_rollups(df: pd.DataFrame, data_type_cls, session: Session):
+    """Folds a freshly loaded batch of rows into the rollup tables of its data type"""
+    for rollup_cls in iter_rollup_models(data_type_cls):
+        log.debug(f"Updating {rollup_cls.__tablename__}...")
+        upsert_aggregates(aggregate_rows(df, rollup_cls), rollup_cls, session)
+
+def rebuild_rollups(session: Session):
+    """Recomputes every rollup table from its source table"""
+    for rollup_cls in rollup_registry.values():
+        log.info(f"Rebuilding {rollup_cls.__tablename__}...")
+        session.execute(delete(rollup_cls.__table__))
+        source = rollup_cls.source_cls.__table__
+        query = select(
+            source.c[rollup_cls.entity_column],
+            source.c.timestamp,
+            *[source.c[c] for c in rollup_cls.value_columns],
+            )
+        for chunk in pd.read_sql(
+                query,
+                session.connection(),
+                parse_dates=['timestamp'],
+                chunksize=REBUILD_CHUNK_SIZE,
+                ):
+            upsert_aggregates(aggregate_rows(chunk, rollup_cls), rollup_cls, session)
+    session.commit()
@@ -0,0 +1,156 @@
+"""SQLite R*Tree spatial indexes and radius / nearest neighbour lookups"""
+
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import column, literal_column, select, table, text
+
+from .database import Session
+from .models import (
+    PollutionData,
+    CulturalEventData,
+    LibraryEventData,
+    TrafficSensor,
+    ParkingLot,
+)
+
+import logging
+log = logging.getLogger(__name__)
+
+EARTH_RADIUS_M = 6_371_008.8
+
+spatial_registry = {
+    'Pollution Data': PollutionData,
+    'Cultural Event Data': CulturalEventData,
+    'Library Event Data': LibraryEventData,
+    'Traffic Sensor': TrafficSensor,
+    'Parking Lot': ParkingLot,
+}
+
+def rtree_table_name(model_cls) -> str:
+    return f"{model_cls.__tablename__}_rtree"
+
+def _rtree_table(model_cls):
+    return table(
+        rtree_table_name(model_cls),
+        column('id'),
+        column('min_lat'),
+        column('max_lat'),
+        column('min_lon'),
+        column('max_lon'),
+        )
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres (vectorised over numpy arrays)"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+def create_spatial_index(model_cls, session: Session):
+    session.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {rtree_table_name(model_cls)} "
+        "USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+        ))
+
+def _insert_bounding_boxes(model_cls, session: Session, where: str = ''):
+    # Each row is indexed by the bounding box of all of its points
+    lats = [lat for lat, _ in model_cls.spatial_columns]
+    lons = [lon for _, lon in model_cls.spatial_columns]
+    if len(lats) == 1:
+        (min_lat,), (min_lon,) = lats, lons
+        max_lat, max_lon = min_lat, min_lon
+    else:
+        min_lat, max_lat = f"MIN({', '.join(lats)})", f"MAX({', '.join(lats)})"
+        min_lon, max_lon = f"MIN({', '.join(lons)})", f"MAX({', '.join(lons)})"
+    not_null = ' AND '.join(f"{c} IS NOT NULL" for c in lats + lons)
+    session.execute(text(
+        f"INSERT INTO {rtree_table_name(model_cls)} "
+        f"SELECT rowid, {min_lat}, {max_lat}, {min_lon}, {max_lon} "
+        f"FROM {model_cls.__tablename__} WHERE {not_null} {where}"
+        ))
+
+def update_spatial_index(model_cls, session: Session):
+    """Indexes the rows of a table added since the index was last updated"""
+    create_spatial_index(model_cls, session)
+    _insert_bounding_boxes(
+        model_cls,
+        session,
+        where=f"AND rowid > (SELECT COALESCE(MAX(id), 0) FROM {rtree_table_name(model_cls)})",
+        )
+
+def rebuild_spatial_index(model_cls, session: Session):
+    """Re-indexes every row of a table"""
+    log.info(f"Rebuilding {rtree_table_name(model_cls)}...")
+    create_spatial_index(model_cls, session)
+    session.execute(text(f"DELETE FROM {rtree_table_name(model_cls)}"))
+    _insert_bounding_boxes(model_cls, session)
+
+def create_spatial_indexes(session: Session):
+    for model_cls in spatial_registry.values():
+        create_spatial_index(model_cls, session)
+    session.commit()
+
+def rebuild_spatial_indexes(session: Session):
+    for model_cls in spatial_registry.values():
+        rebuild_spatial_index(model_cls, session)
+    session.commit()
+
+def _distances(df: pd.DataFrame, model_cls, latitude: float, longitude: float):
+    # Distance to the closest of the row's points
+    return np.nanmin(np.vstack([
+        haversine_distance(latitude, longitude, df[lat].to_numpy(float), df[lon].to_numpy(float))
+        for lat, lon in model_cls.spatial_columns
+        ]), axis=0)
+
+def within_radius(
+    model_cls,
+    latitude: float,
+    longitude: float,
+    radius_m: float,
+    session: Session,
+    ) -> pd.DataFrame:
+    """
+    Returns the rows of `model_cls` within `radius_m` metres of a point, nearest
+    first, with their distance in a `distance_m` column.
+    """
+    # Candidate rows come from the bounding box of the circle, then are filtered exactly
+    d_lat = np.degrees(radius_m / EARTH_RADIUS_M)
+    d_lon = np.degrees(radius_m / (EARTH_RADIUS_M * max(np.cos(np.radians(latitude)), 1e-12)))
+    rtree = _rtree_table(model_cls)
+    source = model_cls.__table__
+    query = select(source).join_from(
+        source,
+        rtree,
+        literal_column(f"{source.name}.rowid") == rtree.c.id,
+        ).where(
+        rtree.c.max_lat >= latitude - d_lat,
+        rtree.c.min_lat <= latitude + d_lat,
+        rtree.c.max_lon >= longitude - d_lon,
+        rtree.c.min_lon <= longitude + d_lon,
+        )
+    df = pd.read_sql(query, session.connection())
+    df['distance_m'] = _distances(df, model_cls, latitude, longitude) if len(df) else []
+    df = df[df['distance_m'] <= radius_m]
+    return df.sort_values('distance_m').reset_index(drop=True)
+
+def nearest(
+    model_cls,
+    latitude: float,
+    longitude: float,
+    session: Session,
+    k: int = 1,
+    initial_radius_m: float = 250.0,
+    ) -> pd.DataFrame:
+    """
+    Returns the `k` rows of `model_cls` nearest to a point, with their distance
+    in a `distance_m` column.
+    """
+    # Widen the search until the circle holds k rows, at which point no row
+    # outside the circle can be nearer than the k-th row inside it
+    radius_m = initial_radius_m
+    while True:
+        df = within_radius(model_cls, latitude, longitude, radius_m, session)
+        if len(df) >= k or radius_m >= np.pi * EARTH_RADIUS_M:
+            return df.head(k)
+        radius_m *= 4
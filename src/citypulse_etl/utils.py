@@ -1,21 +1,28 @@
 """Common utility functions and constants"""
 
 import os
-import requests
 
-from dotenv import load_dotenv
-load_dotenv()
+from functools import lru_cache
 
-RAW_DATA_DIR = os.getenv('RAW_DATA_DIR')
-if not os.path.exists(RAW_DATA_DIR):
-    os.makedirs(RAW_DATA_DIR)
+@lru_cache(maxsize=None)
+def load_env():
+    """Loads the `.env` file into the environment (once, on first use)"""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+def raw_data_dir() -> str:
+    load_env()
+    path = os.getenv('RAW_DATA_DIR')
+    os.makedirs(path, exist_ok=True)
+    return path
 
 def url_to_filename(url: str):
     return url.split('/')[-1]
 
 def download_file(url: str, fname: str):
+    import requests
     r = requests.get(url)
-    fpath = os.path.join(RAW_DATA_DIR, fname)
+    fpath = os.path.join(raw_data_dir(), fname)
     with open(fpath, 'wb') as fp:
         fp.write(r.content)
 
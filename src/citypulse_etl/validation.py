@@ -0,0 +1,81 @@
+"""Vectorised row-level data quality checks, quarantining the rows which fail"""
+
+import json
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+from typing import Tuple
+
+from .database import Session
+from .models import Dataset, QuarantinedRow
+
+import logging
+log = logging.getLogger(__name__)
+
+def check_column(values: pd.Series, column_type: str, rules: dict):
+    """Returns a column's values coerced to its type, and the `(failing rows, reason)` of each rule"""
+    checks = []
+    missing = values.isna()  # once, as it's a pass over every value of text columns
+    if rules.get('required'):
+        checks.append((missing, 'required'))
+    if column_type in ('integer', 'float') and not pd.api.types.is_numeric_dtype(values):
+        coerced = pd.to_numeric(values, errors='coerce')
+        checks.append((~missing & coerced.isna(), 'not a number'))
+        values = coerced
+    elif column_type == 'datetime':
+        coerced = pd.to_datetime(values, errors='coerce')
+        checks.append((~missing & coerced.isna(), 'not a datetime'))
+        values = coerced
+    if 'min' in rules:
+        checks.append((values < rules['min'], f"below {rules['min']}"))
+    if 'max' in rules:
+        checks.append((values > rules['max'], f"above {rules['max']}"))
+    return values, checks
+
+def check_rows(df: pd.DataFrame, data_type_cls) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Checks the type, `required` and `min` / `max` rules of the columns of raw
+    data, returning the rows which pass (with values coerced to their types)
+    and the rows which fail, with the reasons in a `reasons` column.
+    """
+    raw_names = {c: raw for raw, c in data_type_cls.raw_data_column_map.items()}
+    raw_df = df.copy(deep=False)  # rejects are kept as they were read
+    checks = []
+    for c, column_type in data_type_cls.column_types.items():
+        raw = raw_names.get(c, c)
+        if raw not in df.columns:
+            continue
+        df[raw], column_checks = check_column(df[raw], column_type, data_type_cls.column_rules.get(c, {}))
+        checks.extend((failing.to_numpy(), f"{c}: {reason}") for failing, reason in column_checks)
+    bad = np.zeros(len(df), dtype=bool)
+    for failing, _ in checks:
+        bad |= failing
+    if not bad.any():
+        return df, df.iloc[:0].assign(reasons=pd.Series(dtype=object))
+    reasons = np.full(bad.sum(), '', dtype=object)
+    for failing, reason in checks:
+        failing = failing[bad]
+        reasons[failing] = reasons[failing] + np.where(reasons[failing] == '', '', '; ') + reason
+    return df[~bad], raw_df[bad].assign(reasons=reasons)
+
+def quarantine_rows(rejects: pd.DataFrame, fname: str, dataset: Dataset, data_type_cls, session: Session):
+    """Writes rows which failed validation to the `quarantined_rows` table"""
+    if rejects.empty:
+        return
+    data = rejects.drop(columns='reasons')
+    data = data.astype(object).where(data.notna(), None)
+    quarantined_at = datetime.now()
+    session.execute(QuarantinedRow.__table__.insert(), [
+        dict(
+            dataset_id=dataset.id,
+            data_type=data_type_cls.__tablename__,
+            file_name=fname,
+            row_number=int(row_number),
+            reasons=reasons,
+            data=json.dumps(record, default=str),
+            quarantined_at=quarantined_at,
+            )
+        for row_number, reasons, record in zip(
+            rejects.index, rejects['reasons'], data.to_dict(orient='records'))
+        ])
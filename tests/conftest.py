@@ -0,0 +1,27 @@
+import pytest
+
+from citypulse_etl import database, models
+
+@pytest.fixture(autouse=True)
+def unpartitioned(monkeypatch):
+    """Leaves the tables unpartitioned, unless a test sets `PARTITIONED_TABLES`"""
+    monkeypatch.delenv('PARTITIONED_TABLES', raising=False)
+
+@pytest.fixture
+def db_file(tmp_path, monkeypatch):
+    """A fresh database with the package's tables, used by `database.Session`"""
+    db_file = str(tmp_path / 'database.db')
+    monkeypatch.setenv('DB_CONNECTION_DRIVER', 'sqlite')
+    monkeypatch.setenv('SQLITE_DB_FILE', db_file)
+    monkeypatch.setenv('RAW_DATA_DIR', str(tmp_path / 'raw'))
+    database.get_engine.cache_clear()
+    models.create_tables()
+    yield db_file
+    database.get_engine().dispose()
+    database.get_engine.cache_clear()
+
+@pytest.fixture
+def session(db_file):
+    session = database.Session()
+    yield session
+    session.close()
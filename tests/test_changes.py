@@ -0,0 +1,55 @@
+import os
+
+import pandas as pd
+import pytest
+
+from citypulse_etl import changes, cli, models, pipeline
+from citypulse_etl.database import Session
+
+def parking_dataset(name, start, n_rows=200):
+    raw_data_dir = os.environ['RAW_DATA_DIR']
+    os.makedirs(raw_data_dir, exist_ok=True)
+    fname = f'{name}.csv'
+    timestamps = pd.date_range(start, periods=n_rows, freq='30min').astype(str)
+    pd.DataFrame({
+        'vehiclecount': 10,
+        'updatetime': timestamps,
+        '_id': range(n_rows),
+        'totalspaces': 100,
+        'garagecode': 'NORREPORT',
+        'streamtime': timestamps,
+    }).to_csv(os.path.join(raw_data_dir, fname), index=False)
+    return {'name': name, 'data_type': 'Parking Data', 'url': f'http://localhost/{fname}', 'location': 'Aarhus'}
+
+def missing_dataset():
+    return {'name': 'missing', 'data_type': 'Parking Data', 'url': 'http://localhost/missing.tar.gz', 'location': 'Aarhus'}
+
+def test_changes_of_a_failed_run_are_listed(session):
+    with pytest.raises(FileNotFoundError):
+        cli.run_pipelines([parking_dataset('parking-1', '2014-08-01'), missing_dataset()], skip_download=True)
+    cli.run_pipelines([parking_dataset('parking-2', '2014-09-01')], skip_download=True)
+
+    runs = {r.id: r.status for r in session.query(models.IngestionRun)}
+    assert runs == {1: 'failed', 2: 'ok'}
+    listed = changes.changes_since(0, session)
+    assert listed[['run_id', 'table_name', 'row_count']].values.tolist() == [
+        [1, 'parking_data', 200],
+        [2, 'parking_data', 200],
+        ]
+    assert len(changes.changed_rows(models.ParkingData, 0, session)) == 400
+    assert len(changes.changed_rows(models.ParkingData, 1, session)) == 200
+
+def test_runs_left_running_are_closed_out(session):
+    killed = models.IngestionRun.start(session)
+    models.IngestionRun.start(Session())
+    session.refresh(killed)
+    assert killed.status == 'failed' and killed.finished_at is not None
+
+def test_running_runs_are_not_listed(session):
+    run = models.IngestionRun.start(session)
+    run_id = run.id
+    session.commit()
+    pipeline.run_pipeline(parking_dataset('parking-1', '2014-08-01'), skip_download=True, run_id=run_id)
+    assert changes.changes_since(0, session).empty
+    run.finish(session)
+    assert changes.changes_since(0, session)['run_id'].tolist() == [run_id]
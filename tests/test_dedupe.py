@@ -0,0 +1,40 @@
+import os
+import tarfile
+
+import pandas as pd
+
+from sqlalchemy import func
+
+from citypulse_etl import models, pipeline
+
+def pollution_dataset(name, sensors, n_rows=100):
+    raw_data_dir = os.environ['RAW_DATA_DIR']
+    os.makedirs(raw_data_dir, exist_ok=True)
+    df = pd.DataFrame({
+        'ozone': 100,
+        'particullate_matter': 50,
+        'carbon_monoxide': 25,
+        'sulfure_dioxide': 10,
+        'nitrogen_dioxide': 5,
+        'longitude': 10.1,
+        'latitude': 56.1,
+        'timestamp': pd.date_range('2014-08-01', periods=n_rows, freq='5min').astype(str),
+    })
+    fname = f'{name}.tar.gz'
+    with tarfile.open(os.path.join(raw_data_dir, fname), 'w:gz') as tar:
+        for sensor in sensors:
+            path = os.path.join(raw_data_dir, f'pollutionData{sensor}.csv')
+            df.to_csv(path, index=False, header=False)
+            tar.add(path, arcname=os.path.basename(path))
+    return {'name': name, 'data_type': 'Pollution Data', 'url': f'http://localhost/{fname}', 'location': 'Aarhus'}
+
+def test_files_with_the_same_content_for_different_sensors_are_loaded(session):
+    dataset = pollution_dataset('pollution', [158324, 158355])
+    pipeline.run_pipeline(dataset, skip_download=True)
+    report_id = models.PollutionData.report_id
+    assert dict(session.query(report_id, func.count()).group_by(report_id).all()) == {158324: 100, 158355: 100}
+
+    # Loading the same files again skips them whole
+    pipeline.run_pipeline(dataset, skip_download=True)
+    assert session.query(models.PollutionData).count() == 200
+    assert session.query(models.FileFingerprint).count() == 2
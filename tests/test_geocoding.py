@@ -0,0 +1,101 @@
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from citypulse_etl import geocoding
+
+POINTS = [(56.1, 10.1), (56.2, 10.2), (56.3, 10.3), (56.4, 10.4)]
+
+
+class StubProvider(geocoding.GeocodingProvider):
+    """Returns an address per point, failing the calls numbered in `fail_calls` and any for `fail_points`"""
+
+    def __init__(self, fail_calls=(), fail_points=()):
+        self.fail_calls = set(fail_calls)
+        self.fail_points = set(fail_points)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def reverse(self, latitude, longitude):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        if call in self.fail_calls or (latitude, longitude) in self.fail_points:
+            raise RuntimeError('429 Too Many Requests')
+        return {'road': f'{latitude},{longitude}'}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = geocoding.GeocodingCache(str(tmp_path / 'geocoding-cache.db'))
+    yield cache
+    cache.close()
+
+def cached_count(cache):
+    return cache.conn.execute("SELECT count(*) FROM geocodes").fetchone()[0]
+
+def test_provider_is_abstract():
+    with pytest.raises(TypeError):
+        geocoding.GeocodingProvider()
+
+def test_failures_are_retried(cache):
+    provider = StubProvider(fail_calls={3})
+    addresses = geocoding.resolve_addresses(POINTS, provider, cache, max_workers=1, backoff=0)
+    assert addresses == {p: {'road': f'{p[0]},{p[1]}'} for p in POINTS}
+    assert provider.calls == len(POINTS) + 1
+    assert cached_count(cache) == len(POINTS)
+
+def test_failed_points_are_skipped_and_the_rest_cached(cache):
+    provider = StubProvider(fail_points={POINTS[1]})
+    addresses = geocoding.resolve_addresses(POINTS, provider, cache, max_attempts=2, backoff=0)
+    assert set(addresses) == set(POINTS) - {POINTS[1]}
+    assert cached_count(cache) == len(POINTS) - 1
+    # Only the failed point is requested again
+    provider = StubProvider()
+    geocoding.resolve_addresses(POINTS, provider, cache, backoff=0)
+    assert provider.calls == 1
+    assert cached_count(cache) == len(POINTS)
+
+def test_nominatim_rate_limited_server(cache):
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.path)
+            if len(requests_seen) == 3:
+                self.send_response(429)
+                self.end_headers()
+                return
+            body = json.dumps({'address': {'road': 'Stubvej', 'city': 'Aarhus'}}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        provider = geocoding.NominatimProvider(url=f'http://127.0.0.1:{server.server_port}/reverse')
+        addresses = geocoding.resolve_addresses(POINTS, provider, cache, backoff=0)
+    finally:
+        server.shutdown()
+    assert len(addresses) == len(POINTS)
+    assert len(requests_seen) == len(POINTS) + 1
+    assert cached_count(cache) == len(POINTS)
+
+def test_gazetteer_provider(tmp_path, cache):
+    fname = tmp_path / 'gazetteer.csv'
+    fname.write_text(
+        "latitude,longitude,road,city,postcode,country\n"
+        "56.1,10.1,Nørregade,Aarhus,8000,Denmark\n"
+        )
+    provider = geocoding.GazetteerProvider(str(fname))
+    addresses = geocoding.resolve_addresses([(56.1, 10.1), (57.0, 11.0)], provider, cache)
+    assert geocoding.format_address(addresses[(56.1, 10.1)]) == 'Nørregade, Aarhus 8000, Denmark'
+    assert addresses[(57.0, 11.0)] is None
@@ -0,0 +1,51 @@
+import sqlite3
+
+import pandas as pd
+
+from citypulse_etl import models, pipeline
+from citypulse_etl.database import Session
+
+XML = '<p>' + 'koncert ' * 200 + '</p>'
+
+def test_offloaded_text_set_on_instance_is_stored(session):
+    event = models.CulturalEventData(name='Koncert', xml=XML, timestamp=pd.Timestamp('2014-08-01'))
+    assert event.xml_digest == models.TextPayload.digest_text(XML)
+    assert event.xml == XML
+    session.add(event)
+    session.commit()
+    event_id = event.id
+    session.close()
+
+    session = Session()
+    event = session.get(models.CulturalEventData, event_id)
+    assert event.xml == XML
+    assert session.query(models.TextPayload).count() == 1
+    event.xml = None
+    session.commit()
+    assert session.get(models.CulturalEventData, event_id).xml_digest is None
+    session.close()
+
+def test_decoded_views_read_without_inflate(session, db_file):
+    df = pd.DataFrame({
+        'name': ['Koncert'],
+        'event_id': ['1'],
+        'city': pd.Categorical(['Aarhus C']),
+        'event_type': pd.Categorical(['Musik']),
+        'genre': pd.Categorical(['Klassisk']),
+        'xml': [XML],
+        'timestamp': [pd.Timestamp('2014-08-01')],
+        'dataset_id': [1],
+    })
+    pipeline.insert_rows_from_df(df, models.CulturalEventData, session)
+    session.commit()
+
+    # A plain connection, as in the sqlite3 shell or an analyst's snapshot
+    conn = sqlite3.connect(db_file)
+    for cls in (models.CulturalEventData, models.LibraryEventData, models.SocialEventData):
+        conn.execute(f"SELECT count(*) FROM {models.decoded_view(cls).name}").fetchone()
+    city, digest = conn.execute("SELECT city, xml_digest FROM cultural_event_data_view").fetchone()
+    conn.close()
+    assert (city, digest) == ('Aarhus C', models.TextPayload.digest_text(XML))
+
+    decoded = pd.read_sql(models.decoded_select(models.CulturalEventData), session.connection())
+    assert decoded.loc[0, 'xml'] == XML
@@ -0,0 +1,68 @@
+import warnings
+
+import pandas as pd
+import pytest
+
+from sqlalchemy import event, text
+
+from citypulse_etl import models, partitions, pipeline, query
+
+@pytest.fixture
+def partitioned_session(monkeypatch, request):
+    # Set before the shared fixtures create the tables
+    monkeypatch.setenv('PARTITIONED_TABLES', 'road_traffic_data,parking_data')
+    return request.getfixturevalue('session')
+
+def traffic(timestamps):
+    return pd.DataFrame({
+        'status': pd.Categorical(['OK'] * len(timestamps)),
+        'avg_speed': 50.0,
+        'timestamp': timestamps,
+        'report_id': 1,
+        'dataset_id': 1,
+    })
+
+def test_rows_are_routed_to_monthly_partitions(partitioned_session):
+    session = partitioned_session
+    timestamps = pd.to_datetime(['2014-08-31 23:00', '2014-09-01 00:00', '2014-09-02 00:00'])
+    assert pipeline.insert_rows_from_df(traffic(timestamps), models.RoadTrafficData, session) == (1, 3)
+    assert set(partitions.list_partitions(models.RoadTrafficData, session)) == {
+        'road_traffic_data_default', 'road_traffic_data_p201408', 'road_traffic_data_p201409'}
+    assert session.execute(text("SELECT count(*) FROM road_traffic_data")).scalar() == 3
+    september = partitions.pruned_source(models.RoadTrafficData, session, pd.Timestamp('2014-09-01'), pd.Timestamp('2014-09-03'))
+    assert session.execute(september.select()).all()[0].id == 2
+
+def test_timezone_aware_timestamps_are_partitioned_by_local_time(partitioned_session):
+    timestamps = pd.to_datetime(['2014-09-01 01:00']).tz_localize('Europe/Copenhagen')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        pipeline.insert_rows_from_df(traffic(timestamps), models.RoadTrafficData, partitioned_session)
+    assert set(partitions.list_partitions(models.RoadTrafficData, partitioned_session)) == {
+        'road_traffic_data_default', 'road_traffic_data_p201409'}
+    readings = query.traffic_for_sensor(
+        1, pd.Timestamp('2014-09-01'), pd.Timestamp('2014-09-02'), session=partitioned_session, use_cache=False)
+    assert len(readings) == 1
+
+def test_parking_occupancy_reads_only_the_partitions_in_range(partitioned_session):
+    session = partitioned_session
+    timestamps = pd.to_datetime(['2014-08-31 23:00', '2014-09-01 00:00'])
+    parking = pd.DataFrame({
+        'vehicle_count': [10, 20],
+        'timestamp': timestamps,
+        'total_spaces': 100,
+        'garage_code': 'NORREPORT',
+        'dataset_id': 1,
+    })
+    pipeline.insert_rows_from_df(parking, models.ParkingData, session)
+    statements = []
+    event.listen(session.connection(), 'before_cursor_execute', lambda conn, cursor, sql, *args: statements.append(sql))
+    occupancy = query.parking_occupancy(
+        'NORREPORT', pd.Timestamp('2014-09-01'), pd.Timestamp('2014-09-02'), session=session, use_cache=False)
+    assert occupancy['occupancy'].tolist() == [0.2]
+    read = [sql for sql in statements if 'vehicle_count' in sql]
+    assert 'parking_data_p201409' in read[0] and 'parking_data_p201408' not in read[0]
+
+@pytest.mark.parametrize('cls', [models.SocialEventData, models.WeatherData, models.PollutionData])
+def test_tables_which_cant_be_partitioned(session, cls):
+    with pytest.raises(ValueError):
+        partitions.create_partitioned_table(cls, session.connection())
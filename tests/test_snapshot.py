@@ -0,0 +1,14 @@
+import logging
+
+from citypulse_etl import snapshot
+
+def test_snapshot_of_a_wal_database(session, tmp_path, caplog):
+    manifest = snapshot.create_snapshot(str(tmp_path / 'snapshot'))
+    assert snapshot.verify_snapshot(str(tmp_path / 'snapshot')) == manifest
+    assert not [r for r in caplog.records if r.levelno >= logging.WARNING]
+
+def test_snapshot_warns_without_wal(monkeypatch, request, tmp_path, caplog):
+    monkeypatch.setenv('SQLITE_JOURNAL_MODE', 'DELETE')
+    request.getfixturevalue('db_file')
+    snapshot.create_snapshot(str(tmp_path / 'snapshot'))
+    assert 'delete journal mode' in caplog.text